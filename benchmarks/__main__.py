@@ -0,0 +1,262 @@
+"""Benchmark suite for the ingestion and evaluation hot paths.
+
+Usage:
+    python -m benchmarks [--output bench.json] [--baseline bench-old.json] [--frames records/] [--redis]
+
+Runs on fixed synthetic inputs (or on frames recorded with RECORD_DIR) and writes the results together with the
+commit they were measured on to a JSON file. With --baseline every result is also compared to an earlier run.
+--redis adds check_price_change latency against the Redis-TimeSeries at REDIS_URI.
+"""
+
+import argparse
+import asyncio
+import gc
+import gzip
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+os.environ.setdefault("BOT_API_KEY", "benchmark")
+os.environ.setdefault("TARGET_IDS", "[0]")
+os.environ.setdefault("SIGNAL_THRESHOLDS", '["5,4","20,10"]')
+os.environ.setdefault("LOCAL_WINDOWS", "1")
+
+from benchmarks.market_state import BenchScreener, synthetic_traffic  # noqa: E402
+from benchmarks.vectorized import synthetic_windows  # noqa: E402
+from msgspec import json  # noqa: E402
+
+from adapters import adapters  # noqa: E402
+from adapters.decompress import GZIP_WBITS  # noqa: E402
+from adapters.recorder import read_frames  # noqa: E402
+from core.signals import evaluate_prices  # noqa: E402
+from core.telegram import create_tg_message  # noqa: E402
+from core.vectorized import PriceWindows, evaluate_windows  # noqa: E402
+
+FRAMES_PER_EXCHANGE = 20_000
+
+
+def best_of(func: Callable[[], Any], repeat: int) -> float:
+    gc.disable()
+    try:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+    finally:
+        gc.enable()
+
+
+def synthetic_frames(exchange: str, count: int, seed: int = 42) -> list[bytes]:
+    rnd = random.Random(seed)  # noqa: S311
+    now = int(time.time() * 1000)
+    frames = []
+    for i in range(count):
+        ts, price = now + i, f"{rnd.uniform(0.01, 1000):.4f}"
+        trades = rnd.choice((1, 1, 1, 2, 5))
+        match exchange:
+            case "binance":
+                data = {"e": "trade", "E": ts, "s": "BTCUSDT", "t": i, "p": price, "q": "0.01", "T": ts, "m": True}
+                frame = {"stream": "btcusdt@trade", "data": data}
+            case "bybit":
+                data = {"T": ts, "s": "BTCUSDT", "S": "Buy", "v": "0.01", "p": price, "L": "PlusTick", "BT": False}
+                frame = {"topic": "publicTrade.BTCUSDT", "type": "snapshot", "ts": ts, "data": [data] * trades}
+            case "gate":
+                data = {"size": 1, "id": i, "create_time": ts // 1000, "create_time_ms": ts, "price": price}
+                frame = {
+                    "time": ts // 1000,
+                    "time_ms": ts,
+                    "channel": "futures.trades",
+                    "event": "update",
+                    "result": [data | {"contract": "BTC_USDT"}] * trades,
+                }
+            case "okx":
+                data = {
+                    "instId": "BTC-USDT-SWAP",
+                    "tradeId": str(i),
+                    "px": price,
+                    "sz": "1",
+                    "side": "buy",
+                    "ts": str(ts),
+                }
+                frame = {"arg": {"channel": "trades", "instId": "BTC-USDT-SWAP"}, "data": [data] * trades}
+            case "htx":
+                data = {"amount": 2, "ts": ts, "id": i, "price": float(price), "direction": "buy"}
+                tick = {"id": i, "ts": ts, "data": [data] * trades}
+                frame = {"ch": "market.BTC-USDT.trade.detail", "ts": ts, "tick": tick}
+        # htx sends gzipped binary frames, decompression is a part of its decode cost
+        encoded = json.encode(frame)
+        frames.append(gzip.compress(encoded) if exchange == "htx" else encoded)
+    return frames
+
+
+def recorded_frames(path: str) -> dict[str, list[bytes]]:
+    frames = defaultdict(list)
+    for frame in read_frames(path):
+        frames[frame.exchange].append(frame.data)
+    return frames
+
+
+def bench_decode(frames: dict[str, list[bytes]], repeat: int) -> dict[str, dict]:
+    results = {}
+    for exchange, exchange_frames in frames.items():
+        adapter = adapters[exchange]
+
+        def decode(adapter: Any = adapter, exchange_frames: list[bytes] = exchange_frames) -> None:
+            for data in exchange_frames:
+                if data[:2] == b"\x1f\x8b":
+                    data = zlib.decompress(data, GZIP_WBITS)
+                try:
+                    adapter.decode_trades(data)
+                except ValueError:
+                    pass  # control frames fall back to the generic decoder, their share is small
+
+        results[f"decode.{exchange}"] = {"value": len(exchange_frames) / best_of(decode, repeat), "unit": "frames/s"}
+    return results
+
+
+async def bench_process_trades(repeat: int) -> dict[str, dict]:
+    traffic = synthetic_traffic(messages=100_000)
+    batches = [([exchange] * len(trades), trades) for exchange, trades in traffic]
+    trades = sum(len(message[1]) for message in traffic)
+
+    timings = []
+    for _ in range(repeat):
+        screener = BenchScreener()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for exchanges, batch in batches:
+                await screener.process_batch(exchanges, batch, 0)
+            timings.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return {"screener.process_trades": {"value": trades / min(timings), "unit": "trades/s"}}
+
+
+def bench_evaluate(repeat: int) -> dict[str, dict]:
+    now = time.time()
+    market_keys, price_data = synthetic_windows(1000, 600, now)
+    windows = PriceWindows(market_keys, price_data)
+
+    def scalar() -> None:
+        for data in price_data:
+            evaluate_prices(data, now)
+
+    return {
+        "signals.evaluate_prices": {"value": len(market_keys) / best_of(scalar, repeat), "unit": "markets/s"},
+        "signals.evaluate_windows": {
+            "value": len(market_keys) / best_of(lambda: evaluate_windows(windows, now), repeat),
+            "unit": "markets/s",
+        },
+    }
+
+
+def bench_render(repeat: int) -> dict[str, dict]:
+    count = 10_000
+
+    def render() -> None:
+        for i in range(count):
+            create_tg_message("bybit", "BTCUSDT", bool(i % 2), 5, 4.2, 61234.5, 63800.25, i % 10)
+
+    return {"telegram.create_tg_message": {"value": count / best_of(render, repeat), "unit": "messages/s"}}
+
+
+async def bench_check_price_change(markets: int = 200) -> dict[str, dict]:
+    from core.redis import redis
+    from worker import check_price_change
+
+    now_ms = int(time.time() * 1000)
+    market_keys = [f"bench_COIN{i}USDT" for i in range(markets)]
+    async with redis.pipeline(transaction=False) as pipe:
+        for market_key in market_keys:
+            pipe.delete(market_key)
+            pipe.ts().create(market_key, labels={"exchange": "bench", "type": "trades"})
+            # a flat window, the measured path reads and evaluates it but never crosses a threshold
+            pipe.ts().madd([(market_key, now_ms - 600_000 + i * 1000, 100 + i % 3 * 0.01) for i in range(600)])
+        await pipe.execute()
+
+    try:
+        latencies = []
+        for market_key in market_keys:
+            start = time.perf_counter()
+            await check_price_change(market_key, check_timeout=0)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        await redis.delete(*market_keys)
+
+    latencies.sort()
+    return {
+        "worker.check_price_change.p50": {"value": statistics.median(latencies) * 1000, "unit": "ms"},
+        "worker.check_price_change.p99": {"value": latencies[int(len(latencies) * 0.99)] * 1000, "unit": "ms"},
+    }
+
+
+def git_commit() -> str:
+    command = ["git", "rev-parse", "--short", "HEAD"]  # noqa: S607
+    try:
+        return subprocess.check_output(command, text=True, stderr=subprocess.DEVNULL).strip()  # noqa: S603
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict[str, dict], baseline_path: str) -> None:
+    baseline = json.decode(Path(baseline_path).read_bytes())
+    print(f"\ncompared to {baseline['commit']} ({baseline['timestamp']}):")
+    for name, result in results.items():
+        if (before := baseline["results"].get(name)) is None:
+            continue
+        # latencies are better when lower, throughputs when higher
+        ratio = before["value"] / result["value"] if result["unit"] == "ms" else result["value"] / before["value"]
+        print(f"  {name:<36} {ratio:>6.2f}x")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default="bench.json", help="where to write the JSON results")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--frames", help="recorded segment file or directory to decode instead of synthetic frames")
+    parser.add_argument("--redis", action="store_true", help="measure check_price_change against REDIS_URI")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    frames = (
+        recorded_frames(args.frames)
+        if args.frames
+        else {exchange: synthetic_frames(exchange, FRAMES_PER_EXCHANGE) for exchange in adapters}
+    )
+    results = bench_decode(frames, args.repeat)
+    results |= await bench_process_trades(args.repeat)
+    results |= bench_evaluate(args.repeat)
+    results |= bench_render(args.repeat)
+    if args.redis:
+        results |= await bench_check_price_change()
+
+    for name, result in results.items():
+        print(f"{name:<38} {result['value']:>14,.2f} {result['unit']}")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "inputs": args.frames or "synthetic",
+        "results": results,
+    }
+    Path(args.output).write_bytes(json.format(json.encode(report)))
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+"""Screener.process_message throughput: dict-of-dicts market state vs MarketStore columns.
+
+Usage:
+    python benchmarks/market_state.py [--traffic messages.jsonl] [--repeat 5]
+
+The traffic file holds one trades message (``{"exchange": ..., "data": [{"s", "p", "T"}]}``) per line.
+Without it a deterministic synthetic session is generated.
+"""
+
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+os.environ.setdefault("BOT_API_KEY", "benchmark")
+os.environ.setdefault("TARGET_IDS", "[0]")
+os.environ.setdefault("SIGNAL_THRESHOLDS", '["5,4","20,10"]')
+os.environ.setdefault("LOCAL_WINDOWS", "0")
+
+from msgspec import json  # noqa: E402
+
+from core.bus import Trade  # noqa: E402
+from core.screener import Screener  # noqa: E402
+
+EXCHANGES = ("bybit", "binance", "gate", "okx", "htx")
+
+
+def synthetic_traffic(markets: int = 3000, messages: int = 200_000, seed: int = 42) -> list[tuple[str, list[Trade]]]:
+    rnd = random.Random(seed)  # noqa: S311
+    symbols = [(EXCHANGES[i % len(EXCHANGES)], f"COIN{i}USDT") for i in range(markets)]
+    weights = [1 / (rank + 1) for rank in range(markets)]
+    prices = {symbol: round(rnd.uniform(0.01, 1000), 4) for symbol in symbols}
+    now = int(time.time() * 1000)
+
+    traffic = []
+    for exchange, symbol in rnd.choices(symbols, weights=weights, k=messages):
+        now += rnd.randint(0, 3)
+        trades = []
+        for _ in range(rnd.choice((1, 1, 1, 2, 5))):
+            if rnd.random() < 0.3:
+                prices[exchange, symbol] = round(prices[exchange, symbol] * rnd.uniform(0.999, 1.001), 4)
+            trades.append(Trade(symbol, prices[exchange, symbol], now))
+        traffic.append((exchange, trades))
+    return traffic
+
+
+def load_traffic(path: str) -> list[tuple[str, list[Trade]]]:
+    traffic = []
+    with open(path, "rb") as file:
+        for message in (json.decode(line) for line in file if line.strip()):
+            trades = [Trade(trade["s"], float(trade["p"]), int(trade["T"])) for trade in message["data"]]
+            traffic.append((message["exchange"], trades))
+    return traffic
+
+
+class BenchScreener(Screener):
+    def __init__(self) -> None:
+        super().__init__()
+        self.writer.batch_size = sys.maxsize
+
+
+class LegacyScreener(BenchScreener):
+    def __init__(self) -> None:
+        super().__init__()
+        self.symbol_prices: dict = {}
+
+    async def create_timeseries(self, exchange: str, symbol: str) -> None:
+        return None
+
+    async def process_batch(self, exchanges: list[str], trades: list[Trade], pass_multiplier: float) -> None:
+        for exchange, trade in zip(exchanges, trades, strict=True):
+            symbol, price, timestamp = trade.symbol, trade.price, trade.ts
+
+            market_key = f"{exchange}_{symbol}"
+            self.trades_count += 1
+
+            if not (market_data := self.symbol_prices.get(market_key, {})):
+                await self.create_timeseries(exchange, symbol)
+                market_data = self.symbol_prices[market_key] = {}
+
+            if (
+                market_data.get("price", 0) == price
+                or market_data.get("saved_ts", 0) == timestamp
+                or market_data.get("saved_ts", 0) > int((time.time() - pass_multiplier) * 1000)
+            ):
+                continue
+
+            self.writer.add(market_key, timestamp, price)
+            market_data["saved_ts"] = timestamp
+            market_data["price"] = price
+            market_data["timestamp"] = timestamp
+            self.dispatcher.mark(market_key)
+
+
+async def measure(screener_class: type[BenchScreener], traffic: list[tuple[str, list[Trade]]]) -> float:
+    screener = screener_class()
+    batches = [([exchange] * len(trades), trades) for exchange, trades in traffic]
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for exchanges, trades in batches:
+            await screener.process_batch(exchanges, trades, 0)
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--traffic", help="JSON lines file with recorded trades queue messages")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    traffic = load_traffic(args.traffic) if args.traffic else synthetic_traffic()
+    trades = sum(len(message[1]) for message in traffic)
+
+    # interleave the runs so both implementations see the same machine noise, keep the best one
+    timings: dict[type[BenchScreener], list[float]] = {LegacyScreener: [], BenchScreener: []}
+    for _ in range(args.repeat):
+        for screener_class, results in timings.items():
+            results.append(await measure(screener_class, traffic))
+
+    before, after = (trades / min(timings[LegacyScreener]), trades / min(timings[BenchScreener]))
+    print(f"dict-of-dicts: {before:,.0f} trades/sec")
+    print(f"MarketStore:   {after:,.0f} trades/sec ({after / before:.2f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
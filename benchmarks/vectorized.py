@@ -0,0 +1,93 @@
+"""Signal evaluation over many markets: scalar evaluate_prices per market vs one evaluate_windows call.
+
+Usage:
+    python benchmarks/vectorized.py [--markets 1000 5000 10000] [--points 600] [--repeat 3]
+
+"vectorized" includes packing the TS.RANGE-like reply lists into arrays, "evaluate only" runs on packed arrays.
+The worker evaluates per market (evaluate_markets) as long as "vectorized" is slower than "scalar".
+Every run also checks that both implementations report exactly the same price changes.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from functools import partial
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+os.environ.setdefault("BOT_API_KEY", "benchmark")
+os.environ.setdefault("TARGET_IDS", "[0]")
+os.environ.setdefault("SIGNAL_THRESHOLDS", '["5,4","20,10"]')
+
+from core.signals import PriceChange, evaluate_markets, max_period  # noqa: E402
+from core.vectorized import PriceWindows, evaluate_windows  # noqa: E402
+
+
+def synthetic_windows(markets: int, points: int, now: float, seed: int = 42) -> tuple[list[str], list[list]]:
+    rnd = random.Random(seed)  # noqa: S311
+    start_ms = (int(now) - max_period) * 1000
+    market_keys, price_data = [], []
+    for i in range(markets):
+        price = rnd.uniform(0.001, 1000)
+        # a mix of quiet, trending and flat markets, so both signal directions and equal subset means show up
+        drift = rnd.choice((0.0, 0.0, 0.0, 0.0, 0.0002, -0.0002))
+        flat = rnd.random() < 0.05
+        timestamps = sorted(rnd.randint(start_ms, int(now * 1000)) for _ in range(rnd.randint(0, points)))
+        data = []
+        for timestamp in timestamps:
+            if not flat:
+                price = round(price * (1 + drift + rnd.gauss(0, 0.0005)), 6)
+            data.append([timestamp, price])
+        market_keys.append(f"bybit_COIN{i}USDT")
+        price_data.append(data)
+    return market_keys, price_data
+
+
+def scalar(market_keys: list[str], price_data: list[list], now: float) -> dict[str, list[PriceChange]]:
+    return evaluate_markets(market_keys, price_data, now)
+
+
+def vectorized(market_keys: list[str], price_data: list[list], now: float) -> dict[str, list[PriceChange]]:
+    return evaluate_windows(PriceWindows(market_keys, price_data), now)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--markets", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--points", type=int, default=600, help="max points per market window")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    now = time.time()
+    for markets in args.markets:
+        market_keys, price_data = synthetic_windows(markets, args.points, now)
+        expected = scalar(market_keys, price_data, now)
+        if (result := vectorized(market_keys, price_data, now)) != expected:
+            raise SystemExit(f"{markets} markets: vectorized results differ from the scalar implementation")
+
+        windows = PriceWindows(market_keys, price_data)
+        timings = {}
+        for name, func in (
+            ("scalar", partial(scalar, market_keys, price_data, now)),
+            ("vectorized", partial(vectorized, market_keys, price_data, now)),
+            ("evaluate only", partial(evaluate_windows, windows, now)),
+        ):
+            durations = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                func()
+                durations.append(time.perf_counter() - start)
+            timings[name] = min(durations)
+
+        print(
+            f"{markets:>6} markets, {len(result)} signalling: scalar {timings['scalar'] * 1000:.1f} ms"
+            f", vectorized {timings['vectorized'] * 1000:.1f} ms ({timings['scalar'] / timings['vectorized']:.1f}x)"
+            f", evaluate only {timings['evaluate only'] * 1000:.1f} ms"
+            f" ({timings['scalar'] / timings['evaluate only']:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,11 @@ from .gate import gate_wss
 from .htx import htx_wss
 from .okx import okx_wss
 
-adapters_list = {
-    "bybit": bybit_wss.wss_connect,
-    "binance": binance_wss.wss_connect,
-    "gate": gate_wss.wss_connect,
-    "okx": okx_wss.wss_connect,
-    "htx": htx_wss.wss_connect,
+adapters = {
+    "bybit": bybit_wss,
+    "binance": binance_wss,
+    "gate": gate_wss,
+    "okx": okx_wss,
+    "htx": htx_wss,
 }
+adapters_list = {exchange: adapter.wss_connect for exchange, adapter in adapters.items()}
@@ -1,16 +1,28 @@
 import asyncio
-import gzip
 import time
-from typing import Any
+from functools import partial
+from typing import Any, Sequence
 
 import structlog
-from aiohttp import ClientSession, ClientWebSocketResponse, WSMsgType, client_exceptions
-from msgspec import MsgspecError, json
+from aiohttp import ClientWebSocketResponse, WSMsgType, client_exceptions
+from msgspec import MsgspecError, ValidationError, json
+
+from adapters.catalog import catalog
+from adapters.decompress import FrameDecompressor
+from adapters.recorder import recorder
+from adapters.session import shared_session
+from core.bus import Trade, TradeBus
+from core.logging import hot_path_log_rate
+from core.metrics import collector
+from core.provisioning import provision_markets
+from settings import settings
 
 logger = structlog.get_logger(__name__)
 decoder = json.Decoder()
 encoder = json.Encoder()
 
+SYMBOLS_CHECK_INTERVAL = 60
+
 
 class SingletonMeta(type):
     _instances: dict = {}
@@ -22,24 +34,50 @@ class SingletonMeta(type):
         return cls._instances[cls]
 
 
+class WSSConnection:
+    """One websocket of an exchange with the share of symbols it is subscribed to."""
+
+    __slots__ = ("index", "symbols", "wss")
+
+    def __init__(self, index: int, symbols: list[str]) -> None:
+        self.index = index
+        self.symbols = symbols
+        self.wss: ClientWebSocketResponse | None = None
+
+
 class BaseExchangeWSS(metaclass=SingletonMeta):
     exchange: str = "base"
     wss_url: str
-    wss_client: ClientWebSocketResponse = None
-    queue: asyncio.Queue = None  # type: ignore
+    symbols_url: str
+    max_streams: int = 200  # symbols per connection, see settings.MAX_STREAMS
+    bus: TradeBus = None  # type: ignore
 
     def __init__(self) -> None:
         self.loop = asyncio.get_event_loop()
+        self.connections: list[WSSConnection] = []
+        self.provisioned: set[str] = set()
+        self.stats = collector.exchange_stats(self.exchange)
+        self.log_rate = hot_path_log_rate()
+
+    def connection_url(self, connection: WSSConnection) -> str:
+        return self.wss_url
 
-    async def after_connect(self) -> None: ...
+    async def after_connect(self, connection: WSSConnection) -> None: ...
 
     async def after_cancel(self) -> None: ...
 
-    async def send_json(self, message: dict[str, Any]) -> None:
-        await logger.adebug(message, exchange=self.exchange)
-        if self.wss_client:
+    async def get_symbols_list(self) -> list[str]:
+        return await catalog.get_symbols(self.exchange, self.symbols_url, self.parse_symbols)
+
+    @staticmethod
+    def parse_symbols(data: Any) -> list[str]:
+        raise NotImplementedError
+
+    async def send_json(self, message: dict[str, Any], connection: WSSConnection) -> None:
+        await logger.adebug(message, exchange=self.exchange, connection=connection.index)
+        if connection.wss:
             try:
-                await self.wss_client.send_str(encoder.encode(message).decode(), compress=False)
+                await connection.wss.send_str(encoder.encode(message).decode(), compress=False)
             except client_exceptions.ClientError:
                 await logger.awarning("Failed to send message", message=message, exchange=self.exchange, exc_info=True)
             except Exception:
@@ -49,77 +87,232 @@ class BaseExchangeWSS(metaclass=SingletonMeta):
         else:
             await logger.awarning("WebSocket connection not established", exchange=self.exchange)
 
-    async def wss_connect(self, queue: asyncio.Queue) -> None:
+    async def wss_connect(self, bus: TradeBus) -> None:
         if not self.wss_url:
             await logger.awarning("WSS URL not set", exchange=self.exchange)
             raise NotImplementedError("WSS URL not set")
-        self.queue = queue
+        self.bus = bus
+        self.connections = []
+        # every connection reconnects on its own, a drop only blinds its share of the symbols
+        tasks: dict[WSSConnection, asyncio.Task] = {}
+        try:
+            while True:
+                # the catalog answers from its cache and refreshes a stale list in the background, so listings
+                # and delistings reach the subscriptions within a check interval of the refresh
+                await self.follow_symbols(await self.load_symbols(), tasks, bus)
+                await self.watch_connections(tasks)
+        except asyncio.CancelledError:
+            await logger.ainfo(f"Task was cancelled: {self.__class__.__name__}")
+            await self.after_cancel()
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    async def follow_symbols(self, symbols: list[str], tasks: dict[WSSConnection, asyncio.Task], bus: TradeBus) -> None:
+        known = {symbol for connection in self.connections for symbol in connection.symbols}
+        if known == set(symbols):
+            return
+        if known:
+            await logger.ainfo(
+                "Symbols changed, resubscribing",
+                exchange=self.exchange,
+                listed=len(set(symbols) - known),
+                delisted=len(known - set(symbols)),
+            )
+
+        changed, emptied = self.split_symbols(symbols)
+        for connection in emptied:
+            task = tasks.pop(connection)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        for connection in changed:
+            if connection not in tasks:
+                tasks[connection] = asyncio.create_task(self.keep_connected(connection, bus))
+            elif connection.wss:
+                # the connection comes back with its new share, subscriptions are only sent on connect
+                await connection.wss.close()
+
+    def split_symbols(self, symbols: list[str]) -> tuple[list[WSSConnection], list[WSSConnection]]:
+        """Moves the connections to a new symbol list, keeping every symbol that stays on its connection.
+
+        Returns the connections whose share changed (new ones included) and the ones left without symbols.
+        """
+        streams = settings.MAX_STREAMS.get(self.exchange, self.max_streams)
+        wanted = set(symbols)
+        known = {symbol for connection in self.connections for symbol in connection.symbols}
+        changed, emptied = [], []
+        for connection in self.connections:
+            if len(kept := [symbol for symbol in connection.symbols if symbol in wanted]) < len(connection.symbols):
+                connection.symbols = kept
+                (changed if kept else emptied).append(connection)
+        self.connections = [connection for connection in self.connections if connection.symbols]
+
+        added = [symbol for symbol in symbols if symbol not in known]
+        for connection in self.connections:
+            if added and (room := streams - len(connection.symbols)) > 0:
+                connection.symbols = connection.symbols + added[:room]
+                added = added[room:]
+                if connection not in changed:
+                    changed.append(connection)
+
+        index = max((connection.index for connection in self.connections), default=-1) + 1
+        for start in range(0, len(added), streams):
+            connection = WSSConnection(index, added[start : start + streams])
+            self.connections.append(connection)
+            changed.append(connection)
+            index += 1
+        return changed, emptied
+
+    @staticmethod
+    async def watch_connections(tasks: dict[WSSConnection, asyncio.Task]) -> None:
+        if not tasks:
+            await asyncio.sleep(SYMBOLS_CHECK_INTERVAL)
+            return
+        # connections never return on their own, a finished one failed and takes the adapter down with it
+        done, _ = await asyncio.wait(
+            tasks.values(), timeout=SYMBOLS_CHECK_INTERVAL, return_when=asyncio.FIRST_EXCEPTION
+        )
+        for task in done:
+            task.result()
+
+    async def load_symbols(self) -> list[str]:
         while True:
             try:
-                async with ClientSession() as session:
-                    await logger.ainfo(f"Connecting to {self.exchange} wss channel", exchange=self.exchange)
-                    async with session.ws_connect(self.wss_url, autoclose=False) as wss:
-                        self.wss_client = wss
-                        await self.after_connect()
-                        await self.receive_messages(queue)
+                return await self.get_symbols_list()
+            except Exception as err:
+                await logger.awarning("Failed to load symbols, retrying...", exchange=self.exchange, exception=err)
+            await asyncio.sleep(5)
+
+    async def keep_connected(self, connection: WSSConnection, bus: TradeBus) -> None:
+        while True:
+            await self.provision(connection)
+            try:
+                session = await shared_session.get()
+                await logger.ainfo(
+                    f"Connecting to {self.exchange} wss channel",
+                    exchange=self.exchange,
+                    connection=connection.index,
+                    streams=len(connection.symbols),
+                )
+                async with session.ws_connect(self.connection_url(connection), autoclose=False) as wss:
+                    connection.wss = wss
+                    await self.after_connect(connection)
+                    await self.receive_messages(connection, bus)
             except asyncio.CancelledError:
-                await logger.ainfo(f"Task was cancelled: {self.__class__.__name__}")
-                if self.wss_client:
-                    await self.wss_client.close()
-                await self.after_cancel()
-                break
+                if connection.wss:
+                    await connection.wss.close()
+                raise
             except Exception as err:
                 await logger.awarning(
                     "WebSocket connection failed, attempting to reconnect...",
                     exchange=self.exchange,
+                    connection=connection.index,
                     exception=err,
                     exc_info=True,
                 )
-                self.wss_client = None
+            connection.wss = None
+            self.stats.reconnects += 1
             await asyncio.sleep(0.25)  # wait before attempting to reconnect
 
-    async def receive_messages(self, queue: asyncio.Queue) -> None:
-        message = ""
-        if not self.wss_client:
+    async def provision(self, connection: WSSConnection) -> None:
+        # series of the share exist before its first trade, the screener never checks for them; only symbols new
+        # to the adapter are provisioned, so a reconnect isn't held up (the writer recreates swept series itself)
+        if not (symbols := [symbol for symbol in connection.symbols if symbol not in self.provisioned]):
+            return
+        try:
+            await provision_markets([(self.exchange, symbol) for symbol in symbols])
+        except Exception as err:
+            await logger.awarning(
+                f"Failed to provision series: {err}", exchange=self.exchange, connection=connection.index
+            )
+            return
+        self.provisioned.update(symbols)
+
+    async def receive_messages(self, connection: WSSConnection, bus: TradeBus) -> None:
+        if not connection.wss:
             await logger.awarning("WebSocket connection not established", exchange=self.exchange)
             await asyncio.sleep(0.25)
             return
-        async for msg in self.wss_client:  # type: ignore
-            if msg and hasattr(msg, "type") and msg.type == WSMsgType.TEXT:
-                try:
-                    message = decoder.decode(msg.data)
-                    await self.process_message(message, queue)
-                except MsgspecError:
-                    await logger.awarning("Failed to decode message", exchange=self.exchange, exc_info=True)
-                except Exception as err:
-                    await logger.awarning(
-                        f"Failed process: {message=}",
-                        exchange=self.exchange,
-                        exc_info=True,
-                        exception=err,
-                    )
-            elif msg.type == WSMsgType.BINARY:
-                message = decoder.decode(gzip.decompress(msg.data).decode())
-                await self.process_message(message, queue)
-
-            elif msg.type in (WSMsgType.ERROR, WSMsgType.CLOSED):
-                await logger.awarning("WebSocket closed", exchange=self.exchange)
-                return
-            else:
-                await logger.awarning(f"Unknown MsgType: {msg.type} ({msg})", exchange=self.exchange)
-        await logger.awarning("Exit from receive_messages", exchange=self.exchange)
-
-    async def process_message(self, message: dict[str, Any], queue: asyncio.Queue) -> None:
-        message_id, message_ts = self.parse_message_metadata(message)
-        message["exchange"] = self.exchange
+        # binary (gzipped) frames are handled by the decompressor task, in order and off the socket reader
+        decompressor = FrameDecompressor(partial(self.receive_frame, bus=bus, connection=connection), self.exchange)
+        try:
+            async for msg in connection.wss:
+                if msg and hasattr(msg, "type") and msg.type == WSMsgType.TEXT:
+                    await self.receive_frame(msg.data, bus, connection)
+                elif msg.type == WSMsgType.BINARY:
+                    await decompressor.put(msg.data)
+                elif msg.type in (WSMsgType.ERROR, WSMsgType.CLOSED):
+                    await logger.awarning("WebSocket closed", exchange=self.exchange, connection=connection.index)
+                    return
+                else:
+                    await logger.awarning(f"Unknown MsgType: {msg.type} ({msg})", exchange=self.exchange)
+        finally:
+            decompressor.close()
+        await logger.awarning("Exit from receive_messages", exchange=self.exchange, connection=connection.index)
 
-        if message.get("topic", "") and message["topic"].startswith("publicTrade"):
-            queue.put_nowait(message)
+    async def receive_frame(self, data: str | bytes, bus: TradeBus, connection: WSSConnection) -> None:
+        if recorder:
+            recorder.record(self.exchange, data)
+        try:
+            await self.handle_frame(data, bus, connection)
+        except MsgspecError:
+            await logger.awarning("Failed to decode message", exchange=self.exchange, exc_info=True)
+        except Exception as err:
+            await logger.awarning(
+                f"Failed process: {data=}",
+                exchange=self.exchange,
+                exc_info=True,
+                exception=err,
+            )
+
+    async def handle_frame(self, data: str | bytes, bus: TradeBus, connection: WSSConnection) -> None:
+        stats = self.stats
+        stats.frames += 1
+        # timing every frame would cost as much as decoding it, histograms only see a sample
+        sampled = not stats.frames % settings.METRICS_SAMPLE_RATE
+        start = time.perf_counter() if sampled else 0.0
+        cpu_start = time.thread_time() if sampled else 0.0
+        try:
+            trades = self.decode_trades(data)
+        except ValidationError:
+            trades = None
+        if sampled:
+            stats.decode_seconds.observe(time.perf_counter() - start)
+
+        # control and subscription frames don't match the trades schema and go through the generic decoder
+        if trades is None:
+            await self.process_message(decoder.decode(data), bus, connection)
+            return
+
+        if trades:
+            stats.trades += len(trades)
+            bus.publish(self.exchange, trades)
+            if sampled:
+                # nothing is awaited between decoding and publishing, the thread's CPU time is this frame's alone
+                stats.cpu_seconds += (time.thread_time() - cpu_start) * settings.METRICS_SAMPLE_RATE
+                stats.latency_seconds.observe(self.calc_latency(trades[-1].ts) / 1000)
+            await bus.wait_writable()
+            if self.log_rate and not stats.frames % self.log_rate:
+                latency = self.calc_latency(trades[-1].ts)
+                logger.debug("trades", exchange=self.exchange, trades=len(trades), latency=latency)
+
+    def decode_trades(self, data: str | bytes) -> Sequence[Trade] | None:
+        return None
+
+    async def process_message(self, message: dict[str, Any], bus: TradeBus, connection: WSSConnection) -> None:
+        if not self.log_sampled():
+            return
+        message_id, message_ts = self.parse_message_metadata(message)
 
         if latency := self.calc_latency(message_ts):
-            await logger.adebug(message, exchange=self.exchange, latency=latency)
+            logger.debug(message, exchange=self.exchange, latency=latency)
         else:
-            await logger.adebug(message, exchange=self.exchange)
+            logger.debug(message, exchange=self.exchange)
+
+    def log_sampled(self) -> bool:
+        # frames are logged synchronously (the handler only enqueues) and only every log_rate-th one at that
+        return bool(self.log_rate) and not self.stats.frames % self.log_rate
 
     def parse_message_metadata(self, message: dict[str, Any]) -> tuple[str, int]:
         if "_" in message.get("id", ""):
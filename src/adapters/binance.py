@@ -1,64 +1,54 @@
-import asyncio
-import time
-from typing import Any
+from typing import Any, Sequence
 
 import structlog
-from aiohttp import ClientSession
+from msgspec import Struct, field, json
 
-from adapters.base import BaseExchangeWSS
+from adapters.base import BaseExchangeWSS, WSSConnection
+from core.bus import Trade, TradeBus
 
 logger = structlog.get_logger(__name__)
 
 
+class BinanceTrade(Trade):
+    event: str = field(name="e")
+    symbol: str = field(name="s")
+    price: float = field(name="p")
+    ts: int = field(name="T")
+
+
+class BinanceStreamFrame(Struct):
+    stream: str
+    data: BinanceTrade
+
+
+trades_decoder = json.Decoder(BinanceStreamFrame, strict=False)
+
+
 class BinanceWSS(BaseExchangeWSS):
     exchange = "binance"
-    wss_url = "wss://stream.binance.com:9443/ws"
-
-    @staticmethod
-    def create_ws_message(method: str, args: list[str]) -> dict[str, Any]:
-        timestamp = int(time.time() * 1000)
-        message = {
-            "id": f"{method.lower()}_{timestamp}".replace(".", "_").lower(),
-            "method": method,
-            "params": args,
-        }
-        return message
+    symbols_url = "https://api.binance.com/api/v3/exchangeInfo"
+    wss_url = "wss://stream.binance.com:9443/stream"
 
     @staticmethod
-    async def get_symbols_list() -> list[str]:
-        async with ClientSession() as session:
-            async with session.get("https://api.binance.com/api/v3/exchangeInfo") as response:
-                data = await response.json()
-                return [
-                    symbol["symbol"]
-                    for symbol in data["symbols"]
-                    if symbol["status"] == "TRADING" and symbol["symbol"].endswith("USDT")
-                ]
-
-    async def after_connect(self) -> None:
-        if self.wss_client:
-            symbols = await self.get_symbols_list()
-            args = [f"{symbol.lower()}@trade" for symbol in symbols]
-            for args_chunk in (args[i : i + 50] for i in range(0, len(args), 50)):
-                await self.send_json(self.create_ws_message("SUBSCRIBE", args=args_chunk))
-
-    async def process_message(self, message: dict[str, Any], queue: asyncio.Queue) -> None:
-        if "subscribe" in message.get("id", ""):
-            latency = self.calc_latency(int(message.get("id").split("_")[-1]))
-            await logger.adebug("subscribed", exchange=self.exchange, latency=latency)
-            return
-
-        elif message.get("e") == "trade":
-            message = {
-                "exchange": self.exchange,
-                "data": [{"s": message["s"], "p": message["p"], "T": message["T"]}],
-            }
-            queue.put_nowait(message)
-
-        if latency := self.calc_latency(message.get("T")):
-            await logger.adebug(message, exchange=self.exchange, latency=latency)
-        else:
-            await logger.adebug(message, exchange=self.exchange)
+    def parse_symbols(data: Any) -> list[str]:
+        return [
+            symbol["symbol"]
+            for symbol in data["symbols"]
+            if symbol["status"] == "TRADING" and symbol["symbol"].endswith("USDT")
+        ]
+
+    def connection_url(self, connection: WSSConnection) -> str:
+        # a combined stream is subscribed by the URL itself, without SUBSCRIBE messages and their rate limit
+        streams = "/".join(f"{symbol.lower()}@trade" for symbol in connection.symbols)
+        return f"{self.wss_url}?streams={streams}"
+
+    def decode_trades(self, data: str | bytes) -> Sequence[Trade] | None:
+        frame = trades_decoder.decode(data)
+        return [frame.data] if frame.data.event == "trade" else None
+
+    async def process_message(self, message: dict[str, Any], bus: TradeBus, connection: WSSConnection) -> None:
+        if self.log_sampled():
+            logger.debug(message, exchange=self.exchange)
 
 
 binance_wss = BinanceWSS()
@@ -1,16 +1,32 @@
 import time
-from typing import Any
+from typing import Any, Sequence
 
 import structlog
-from aiohttp import ClientSession
+from msgspec import Struct, field, json
 
-from adapters.base import BaseExchangeWSS
+from adapters.base import BaseExchangeWSS, WSSConnection
+from core.bus import Trade
 
 logger = structlog.get_logger(__name__)
 
 
+class BybitTrade(Trade):
+    symbol: str = field(name="s")
+    price: float = field(name="p")
+    ts: int = field(name="T")
+
+
+class BybitTradesFrame(Struct):
+    topic: str
+    data: list[BybitTrade]
+
+
+trades_decoder = json.Decoder(BybitTradesFrame, strict=False)
+
+
 class BybitWSS(BaseExchangeWSS):
     exchange = "bybit"
+    symbols_url = "https://api.bybit.com/v2/public/symbols"
     wss_url = "wss://stream.bybit.com/v5/public/linear"
 
     @staticmethod
@@ -19,21 +35,21 @@ class BybitWSS(BaseExchangeWSS):
         return {"op": method, "req_id": f"{method}_{timestamp}".lower(), "args": args}
 
     @staticmethod
-    async def get_symbols_list() -> list[str]:
-        async with ClientSession() as session:
-            async with session.get("https://api.bybit.com/v2/public/symbols") as response:
-                data = await response.json()
-                return [
-                    symbol["name"]
-                    for symbol in data["result"]
-                    if symbol["status"] == "Trading" and symbol["name"].endswith("USDT")
-                ]
-
-    async def after_connect(self) -> None:
-        if self.wss_client:
-            symbols = await self.get_symbols_list()
-            args = [f"publicTrade.{symbol}" for symbol in symbols]
-            await self.send_json(self.create_ws_message("subscribe", args=args))
+    def parse_symbols(data: Any) -> list[str]:
+        return [
+            symbol["name"]
+            for symbol in data["result"]
+            if symbol["status"] == "Trading" and symbol["name"].endswith("USDT")
+        ]
+
+    async def after_connect(self, connection: WSSConnection) -> None:
+        if connection.wss:
+            args = [f"publicTrade.{symbol}" for symbol in connection.symbols]
+            await self.send_json(self.create_ws_message("subscribe", args=args), connection)
+
+    def decode_trades(self, data: str | bytes) -> Sequence[Trade] | None:
+        frame = trades_decoder.decode(data)
+        return frame.data if frame.topic.startswith("publicTrade") else None
 
 
 bybit_wss = BybitWSS()
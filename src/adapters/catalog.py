@@ -0,0 +1,108 @@
+import asyncio
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import structlog
+from aiohttp import ClientTimeout
+from msgspec import MsgspecError, Struct, json
+
+from adapters.session import shared_session
+from settings import settings
+
+logger = structlog.get_logger(__name__)
+
+
+class CatalogEntry(Struct):
+    symbols: list[str]
+    fetched_at: float
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+REQUEST_TIMEOUT = ClientTimeout(total=30)
+
+entry_decoder = json.Decoder(CatalogEntry)
+encoder = json.Encoder()
+
+
+class SymbolCatalog:
+    """Filtered symbol lists of the exchanges, cached in memory and on disk.
+
+    A cached list is returned right away even when it's stale, the stale list is revalidated in the background
+    with ETag / If-Modified-Since, so reconnects resubscribe without waiting for the exchange REST API.
+    """
+
+    def __init__(self, cache_dir: str = settings.SYMBOLS_CACHE_DIR, ttl: int = settings.SYMBOLS_CACHE_TTL) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.entries: dict[str, CatalogEntry] = {}
+        self.refreshes: dict[str, asyncio.Task] = {}
+
+    async def close(self) -> None:
+        for task in self.refreshes.values():
+            task.cancel()
+
+    async def get_symbols(self, exchange: str, url: str, parse: Callable[[Any], list[str]]) -> list[str]:
+        if (entry := self.entries.get(exchange) or self.load(exchange)) is None:
+            return await self.refresh(exchange, url, parse)
+
+        if time.time() - entry.fetched_at > self.ttl and exchange not in self.refreshes:
+            task = asyncio.create_task(self.refresh_in_background(exchange, url, parse))
+            self.refreshes[exchange] = task
+            task.add_done_callback(lambda _: self.refreshes.pop(exchange, None))
+        return entry.symbols
+
+    async def refresh_in_background(self, exchange: str, url: str, parse: Callable[[Any], list[str]]) -> None:
+        try:
+            await self.refresh(exchange, url, parse)
+        except Exception as err:
+            await logger.awarning(f"Failed to refresh symbols: {err}", exchange=exchange, exc_info=True)
+
+    async def refresh(self, exchange: str, url: str, parse: Callable[[Any], list[str]]) -> list[str]:
+        headers = {}
+        if entry := self.entries.get(exchange):
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        session = await shared_session.get()
+        async with session.get(url, headers=headers, timeout=REQUEST_TIMEOUT) as response:
+            if entry and response.status == 304:
+                entry = CatalogEntry(entry.symbols, time.time(), entry.etag, entry.last_modified)
+            else:
+                response.raise_for_status()
+                entry = CatalogEntry(
+                    parse(json.decode(await response.read())),
+                    time.time(),
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                )
+
+        self.entries[exchange] = entry
+        self.save(exchange, entry)
+        await logger.ainfo(f"Symbols refreshed: {len(entry.symbols)}", exchange=exchange)
+        return entry.symbols
+
+    def load(self, exchange: str) -> CatalogEntry | None:
+        try:
+            entry = entry_decoder.decode((self.cache_dir / f"{exchange}.json").read_bytes())
+        except (OSError, MsgspecError):
+            return None
+        self.entries[exchange] = entry
+        return entry
+
+    def save(self, exchange: str, entry: CatalogEntry) -> None:
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            path = self.cache_dir / f"{exchange}.json"
+            # write and rename, so a crash never leaves a truncated cache behind
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(encoder.encode(entry))
+            tmp_path.replace(path)
+        except OSError as err:
+            logger.warning(f"Failed to save symbols cache: {err}", exchange=exchange)
+
+
+catalog = SymbolCatalog()
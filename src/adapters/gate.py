@@ -1,17 +1,33 @@
-import asyncio
 import time
-from typing import Any
+from typing import Any, Sequence
 
 import structlog
-from aiohttp import ClientSession
+from msgspec import Struct, field, json
 
-from adapters.base import BaseExchangeWSS
+from adapters.base import BaseExchangeWSS, WSSConnection
+from core.bus import Trade, TradeBus
 
 logger = structlog.get_logger(__name__)
 
 
+class GateTrade(Trade):
+    symbol: str = field(name="contract")
+    price: float
+    ts: int = field(name="create_time_ms")
+
+
+class GateTradesFrame(Struct):
+    channel: str
+    event: str
+    result: list[GateTrade]
+
+
+trades_decoder = json.Decoder(GateTradesFrame, strict=False)
+
+
 class GateWSS(BaseExchangeWSS):
     exchange = "gate"
+    symbols_url = "https://api.gateio.ws/api/v4/futures/usdt/contracts"
     wss_url = "wss://fx-ws.gateio.ws/v4/ws/usdt"
 
     @staticmethod
@@ -20,39 +36,29 @@ class GateWSS(BaseExchangeWSS):
         return {"time": timestamp, "channel": method, "event": "subscribe", "payload": args}
 
     @staticmethod
-    async def get_symbols_list() -> list[str]:
-        async with ClientSession() as session:
-            async with session.get("https://api.gateio.ws/api/v4/futures/usdt/contracts") as response:
-                data = await response.json()
-                return [
-                    symbol["name"] for symbol in data if not symbol["in_delisting"] and symbol["name"].endswith("USDT")
-                ]
-
-    async def after_connect(self) -> None:
-        if self.wss_client:
-            symbols = await self.get_symbols_list()
-            await self.send_json(self.create_ws_message("futures.trades", args=symbols))
-
-    async def process_message(self, message: dict[str, Any], queue: asyncio.Queue) -> None:
+    def parse_symbols(data: Any) -> list[str]:
+        return [symbol["name"] for symbol in data if not symbol["in_delisting"] and symbol["name"].endswith("USDT")]
+
+    async def after_connect(self, connection: WSSConnection) -> None:
+        if connection.wss:
+            await self.send_json(self.create_ws_message("futures.trades", args=connection.symbols), connection)
+
+    def decode_trades(self, data: str | bytes) -> Sequence[Trade] | None:
+        frame = trades_decoder.decode(data)
+        return frame.result if frame.channel == "futures.trades" and frame.event == "update" else None
+
+    async def process_message(self, message: dict[str, Any], bus: TradeBus, connection: WSSConnection) -> None:
         if message.get("event") == "subscribe":
             latency = self.calc_latency(message.get("time", 0))
             await logger.adebug("subscribed", exchange=self.exchange, latency=latency)
             return
 
-        elif message.get("channel") == "futures.trades":
-            message = {
-                "exchange": self.exchange,
-                "data": [
-                    {"s": msg["contract"], "p": msg["price"], "T": msg["create_time_ms"]}
-                    for msg in message.get("result", [{}])
-                ],
-            }
-            queue.put_nowait(message)
-
+        if not self.log_sampled():
+            return
         if latency := self.calc_latency(message.get("time_ms")):
-            await logger.adebug(message, exchange=self.exchange, latency=latency)
+            logger.debug(message, exchange=self.exchange, latency=latency)
         else:
-            await logger.adebug(message, exchange=self.exchange)
+            logger.debug(message, exchange=self.exchange)
 
 
 gate_wss = GateWSS()
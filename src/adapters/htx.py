@@ -1,61 +1,75 @@
-import asyncio
 import time
-from typing import Any
+from typing import Any, Sequence
 
 import structlog
-from aiohttp import ClientSession
+from msgspec import Struct, json
 
-from adapters.base import BaseExchangeWSS
+from adapters.base import BaseExchangeWSS, WSSConnection, encoder
+from core.bus import Trade, TradeBus
 
 logger = structlog.get_logger(__name__)
 
 
+class HtxTrade(Trade, kw_only=True):
+    # the contract code is only present in the channel name, see HtxWSS.decode_trades
+    symbol: str = ""
+
+
+class HtxTick(Struct):
+    data: list[HtxTrade]
+
+
+class HtxTradesFrame(Struct):
+    ch: str
+    tick: HtxTick
+
+
+trades_decoder = json.Decoder(HtxTradesFrame, strict=False)
+
+
 class HtxWSS(BaseExchangeWSS):
     exchange = "htx"
+    symbols_url = "https://api.hbdm.com/v2/linear-swap-ex/market/detail/batch_merged?business_type=swap"
     wss_url = "wss://api.hbdm.com/linear-swap-ws"
+    max_streams = 100
 
     @staticmethod
     def create_ws_message(method: str, args: list[str]) -> dict[str, Any]:
         return {"sub": args[0], "id": str(int(time.time()))}
 
     @staticmethod
-    async def get_symbols_list() -> list[str]:
-        async with ClientSession() as session:
-            async with session.get(
-                "https://api.hbdm.com/v2/linear-swap-ex/market/detail/batch_merged?business_type=swap"
-            ) as response:
-                data = await response.json()
-                return [s["contract_code"] for s in data["ticks"] if s["contract_code"].endswith("USDT")]
-
-    async def after_connect(self) -> None:
-        if self.wss_client:
-            symbols = await self.get_symbols_list()
-            for symbol in symbols:
-                await self.send_json(self.create_ws_message("sub", args=[f"market.{symbol}.trade.detail"]))
-
-    async def process_message(self, message: dict[str, Any], queue: asyncio.Queue) -> None:
-        await logger.adebug(message, exchange=self.exchange)
+    def parse_symbols(data: Any) -> list[str]:
+        return [s["contract_code"] for s in data["ticks"] if s["contract_code"].endswith("USDT")]
+
+    async def after_connect(self, connection: WSSConnection) -> None:
+        if connection.wss:
+            # htx takes a single topic per sub request, they are written back to back without waiting for replies
+            for symbol in connection.symbols:
+                message = self.create_ws_message("sub", args=[f"market.{symbol}.trade.detail"])
+                await connection.wss.send_str(encoder.encode(message).decode(), compress=False)
+            await logger.adebug(f"subscribing {len(connection.symbols)} contracts", exchange=self.exchange)
+
+    def decode_trades(self, data: str | bytes) -> Sequence[Trade] | None:
+        frame = trades_decoder.decode(data)
+        if not frame.ch.endswith(".trade.detail"):
+            return None
+
+        symbol = frame.ch.split(".")[1]
+        for trade in frame.tick.data:
+            trade.symbol = symbol
+        return frame.tick.data
+
+    async def process_message(self, message: dict[str, Any], bus: TradeBus, connection: WSSConnection) -> None:
         if topic := message.get("subbed"):
             symbol = topic.split(".")[1]
             await logger.adebug(f"subscribed {symbol}", exchange=self.exchange)
             return
         elif message.get("ping"):
-            await self.send_json({"pong": message["ping"]})
+            await self.send_json({"pong": message["ping"]}, connection)
             return
 
-        elif message.get("ch", "").endswith(".trade.detail"):
-            symbol = message["ch"].split(".")[1]
-            try:
-                payload = {
-                    "exchange": self.exchange,
-                    "data": [
-                        {"s": symbol, "p": msg["price"], "T": msg["ts"]} for msg in message["tick"].get("data", [])
-                    ],
-                }
-            except Exception as err:
-                logger.error(f"Failed to process message: {err}", exc_info=True)
-            else:
-                queue.put_nowait(payload)
+        if self.log_sampled():
+            logger.debug(message, exchange=self.exchange)
 
 
 htx_wss = HtxWSS()
@@ -1,16 +1,35 @@
-import asyncio
-from typing import Any
+from typing import Any, Sequence
 
 import structlog
-from aiohttp import ClientSession
+from msgspec import Struct, field, json
 
-from adapters.base import BaseExchangeWSS
+from adapters.base import BaseExchangeWSS, WSSConnection
+from core.bus import Trade, TradeBus
 
 logger = structlog.get_logger(__name__)
 
 
+class OkxTrade(Trade):
+    symbol: str = field(name="instId")
+    price: float = field(name="px")
+    ts: int
+
+
+class OkxChannel(Struct):
+    channel: str
+
+
+class OkxTradesFrame(Struct):
+    arg: OkxChannel
+    data: list[OkxTrade]
+
+
+trades_decoder = json.Decoder(OkxTradesFrame, strict=False)
+
+
 class OkxWSS(BaseExchangeWSS):
     exchange = "okx"
+    symbols_url = "https://www.okx.com/api/v5/public/instruments?instType=SWAP"
     wss_url = "wss://ws.okx.com:8443/ws/v5/public"
 
     @staticmethod
@@ -18,35 +37,25 @@ class OkxWSS(BaseExchangeWSS):
         return {"op": method, "args": args}
 
     @staticmethod
-    async def get_symbols_list() -> list[str]:
-        async with ClientSession() as session:
-            async with session.get("https://www.okx.com/api/v5/public/instruments?instType=SWAP") as response:
-                data = await response.json()
-                return [s["instId"] for s in data["data"] if s["uly"].endswith("USDT")]
-
-    async def after_connect(self) -> None:
-        if self.wss_client:
-            symbols = await self.get_symbols_list()
-            args = [{"channel": "trades", "instId": f"{symbol}"} for symbol in symbols]
-            await self.send_json(self.create_ws_message("subscribe", args=args))
-
-    async def process_message(self, message: dict[str, Any], queue: asyncio.Queue) -> None:
+    def parse_symbols(data: Any) -> list[str]:
+        return [s["instId"] for s in data["data"] if s["uly"].endswith("USDT")]
+
+    async def after_connect(self, connection: WSSConnection) -> None:
+        if connection.wss:
+            args = [{"channel": "trades", "instId": f"{symbol}"} for symbol in connection.symbols]
+            await self.send_json(self.create_ws_message("subscribe", args=args), connection)
+
+    def decode_trades(self, data: str | bytes) -> Sequence[Trade] | None:
+        frame = trades_decoder.decode(data)
+        return frame.data if frame.arg.channel == "trades" else None
+
+    async def process_message(self, message: dict[str, Any], bus: TradeBus, connection: WSSConnection) -> None:
         if message.get("event", "") == "subscribe":
             await logger.adebug("subscribed", exchange=self.exchange)
             return
 
-        elif message.get("arg", {}).get("channel") == "trades":
-            try:
-                message = {
-                    "exchange": self.exchange,
-                    "data": [{"s": msg["instId"], "p": msg["px"], "T": msg["ts"]} for msg in message["data"]],
-                }
-            except Exception as err:
-                logger.error(f"Failed to process message: {err}", exc_info=True)
-            else:
-                queue.put_nowait(message)
-            finally:
-                await logger.adebug(message, exchange=self.exchange)
+        if self.log_sampled():
+            logger.debug(message, exchange=self.exchange)
 
 
 okx_wss = OkxWSS()
@@ -0,0 +1,103 @@
+import asyncio
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Iterator
+
+import structlog
+from msgspec import Struct, msgpack
+
+from core.metrics import collector
+from settings import settings
+
+logger = structlog.get_logger(__name__)
+
+# a segment is a sequence of chunks: little-endian u32 length + zlib compressed msgpack list of frames
+CHUNK_HEADER = struct.Struct("<I")
+SEGMENT_SUFFIX = ".frames"
+
+
+class Frame(Struct, array_like=True):
+    ts: int  # receive time, microseconds
+    exchange: str
+    data: bytes
+
+
+encoder = msgpack.Encoder()
+decoder = msgpack.Decoder(list[Frame])
+
+
+class FrameRecorder:
+    """Appends every raw frame received by the adapters to compressed segment files in RECORD_DIR."""
+
+    def __init__(
+        self,
+        directory: str = settings.RECORD_DIR,
+        segment_seconds: int = settings.RECORD_SEGMENT_SECONDS,
+        flush_interval: float = 1.0,
+        capacity: int = settings.RECORD_BUFFER_CAPACITY,
+    ) -> None:
+        self.directory = Path(directory)
+        self.segment_seconds = segment_seconds
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.frames: list[Frame] = []
+        self.segment: Path | None = None
+        self.segment_started = 0.0
+        self.recorded = 0
+        self.dropped = 0
+
+    def record(self, exchange: str, data: str | bytes) -> None:
+        # a slow disk must not hold every frame in memory, frames that don't fit until the next flush are counted
+        if len(self.frames) >= self.capacity:
+            self.dropped += 1
+            return
+        self.frames.append(Frame(time.time_ns() // 1000, exchange, data.encode() if isinstance(data, str) else data))
+
+    def register_metrics(self) -> None:
+        collector.counter("screener_recorder_frames", "Frames written by the recorder", lambda: self.recorded)
+        collector.counter("screener_recorder_dropped", "Frames dropped by a full recorder buffer", lambda: self.dropped)
+
+    async def run(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush(loop)
+        finally:
+            await self.flush(loop)
+
+    async def flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        if not self.frames:
+            return
+        frames, self.frames = self.frames, []
+        if self.segment is None or time.time() - self.segment_started > self.segment_seconds:
+            self.segment_started = time.time()
+            self.segment = self.directory / f"{time.strftime('%Y%m%d-%H%M%S')}{SEGMENT_SUFFIX}"
+
+        try:
+            # compression and disk io stay off the event loop that receives the frames
+            await loop.run_in_executor(None, write_chunk, self.segment, frames)
+            self.recorded += len(frames)
+        except Exception as err:
+            await logger.aerror(f"Failed to record {len(frames)} frames: {err}", exc_info=True)
+
+
+def write_chunk(path: Path, frames: list[Frame]) -> None:
+    chunk = zlib.compress(encoder.encode(frames))
+    with path.open("ab") as file:
+        file.write(CHUNK_HEADER.pack(len(chunk)) + chunk)
+
+
+def read_frames(path: str | Path) -> Iterator[Frame]:
+    path = Path(path)
+    for segment in sorted(path.glob(f"*{SEGMENT_SUFFIX}")) if path.is_dir() else [path]:
+        with segment.open("rb") as file:
+            while header := file.read(CHUNK_HEADER.size):
+                (length,) = CHUNK_HEADER.unpack(header)
+                yield from decoder.decode(zlib.decompress(file.read(length)))
+
+
+recorder = FrameRecorder() if settings.RECORD_DIR else None
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+import structlog
+
+from adapters.base import BaseExchangeWSS, WSSConnection
+from adapters.recorder import read_frames
+from core.bus import TradeBus
+from settings import settings
+
+logger = structlog.get_logger(__name__)
+
+
+class ReplaySocket:
+    """Stands in for the websocket of a replayed connection and drops everything the adapter sends."""
+
+    closed = False
+
+    async def send_str(self, data: str, compress: int | None = None) -> None: ...
+
+    async def close(self) -> None: ...
+
+
+class FrameReplay:
+    """Feeds recorded frames into the adapters' frame handling, in real time or as fast as possible (speed 0)."""
+
+    def __init__(self, path: str = settings.REPLAY_PATH, speed: float = settings.REPLAY_SPEED) -> None:
+        self.path = path
+        self.speed = speed
+        self.replayed = 0
+
+    async def run(self, adapters: dict[str, BaseExchangeWSS], bus: TradeBus) -> None:
+        connections = {}
+        for exchange, adapter in adapters.items():
+            adapter.bus = bus
+            connections[exchange] = connection = WSSConnection(-1, [])
+            connection.wss = ReplaySocket()  # type: ignore
+
+        await logger.ainfo(f"Replaying frames from {self.path}", speed=self.speed)
+        started, first_ts = time.monotonic(), None
+        for frame in read_frames(self.path):
+            if (adapter := adapters.get(frame.exchange)) is None:
+                continue
+            first_ts = frame.ts if first_ts is None else first_ts
+            if self.speed and (delay := (frame.ts - first_ts) / 1e6 / self.speed - (time.monotonic() - started)) > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                await adapter.handle_frame(frame.data, bus, connections[frame.exchange])
+            except Exception as err:
+                await logger.awarning(f"Failed to replay frame: {err}", exchange=frame.exchange, exc_info=True)
+            self.replayed += 1
+            if not self.speed and not self.replayed % 1000:
+                await asyncio.sleep(0)  # let the screener drain the bus between bursts
+
+        duration = max(time.monotonic() - started, 1e-9)
+        await logger.ainfo(
+            f"Replay finished: {self.replayed} frames in {duration:.1f}s ({self.replayed / duration:.0f}/sec)"
+        )
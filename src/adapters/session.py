@@ -0,0 +1,24 @@
+from aiohttp import ClientSession, TCPConnector
+
+
+class SharedSession:
+    """One aiohttp session for the websockets and REST requests of every exchange running in the process.
+
+    Websockets hold their connection for as long as they live, so the pool is unlimited; REST requests pass
+    their own timeout.
+    """
+
+    def __init__(self) -> None:
+        self.session: ClientSession | None = None
+
+    async def get(self) -> ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = ClientSession(connector=TCPConnector(limit=0, ttl_dns_cache=300))
+        return self.session
+
+    async def close(self) -> None:
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+
+shared_session = SharedSession()
@@ -0,0 +1,225 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import structlog
+
+from adapters import adapters_list
+from core.bus import TradeBus
+from core.metrics import collector
+from settings import settings
+
+logger = structlog.getLogger(__name__)
+
+MAX_RESTART_DELAY = 60.0
+HEALTHY_RUN = 60.0  # an adapter or a process that ran this long restarts without the accumulated backoff
+WATCH_INTERVAL = 1.0
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def process_usage(pid: int | str = "self") -> tuple[float, int]:
+    """CPU seconds and resident memory of a process read from /proc, zeros where there is no /proc."""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+        statm = Path(f"/proc/{pid}/statm").read_text()
+    except OSError:
+        return 0.0, 0
+    # utime and stime are the 14th and 15th fields, counted past the command name that may contain spaces
+    fields = stat.rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, int(statm.split()[1]) * PAGE_SIZE
+
+
+async def watch_parent() -> None:
+    # children aren't daemonic (they may start screener shards), they leave on their own when orphaned
+    while (parent := multiprocessing.parent_process()) and parent.is_alive():
+        await asyncio.sleep(WATCH_INTERVAL)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+class AdapterSupervisor:
+    """Runs the adapters of several exchanges in one event loop, a failed adapter is restarted on its own.
+
+    The adapters share the process: one Redis pool, one HTTP session, one bus and one screener. CPU is only
+    known per process here, the per exchange share is estimated from sampled frames (see ExchangeStats).
+    """
+
+    def __init__(self, exchanges: list[str], restart_delay: float = settings.ADAPTER_RESTART_DELAY) -> None:
+        self.exchanges = exchanges
+        self.restart_delay = restart_delay
+
+    async def run(self, bus: TradeBus) -> None:
+        await asyncio.gather(*(self.supervise(exchange, bus) for exchange in self.exchanges))
+
+    async def supervise(self, exchange: str, bus: TradeBus) -> None:
+        stats = collector.exchange_stats(exchange)
+        delay = self.restart_delay
+        while True:
+            started = time.monotonic()
+            try:
+                await adapters_list[exchange](bus)
+            except Exception as err:
+                await logger.aerror(f"Adapter failed: {err}", exchange=exchange, exc_info=True)
+            # adapters swallow their cancellation, a shutdown must not look like a failure
+            if asyncio.current_task().cancelling():  # type: ignore[union-attr]
+                return
+
+            if time.monotonic() - started > HEALTHY_RUN:
+                delay = self.restart_delay
+            stats.restarts += 1
+            await logger.awarning(f"Restarting adapter in {delay}s", exchange=exchange, restarts=stats.restarts)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    async def usage_watcher(self, timeout: int = 10) -> None:
+        previous = {exchange: (0, 0.0) for exchange in self.exchanges}
+        process_cpu, _ = process_usage()
+        while True:
+            await asyncio.sleep(timeout)
+            usage = []
+            for exchange in self.exchanges:
+                stats = collector.exchange_stats(exchange)
+                frames, cpu = previous[exchange]
+                usage.append(
+                    f"{exchange}: {(stats.frames - frames) / timeout:.0f} frames/sec"
+                    f", cpu ~{(stats.cpu_seconds - cpu) / timeout:.1%}"
+                )
+                previous[exchange] = stats.frames, stats.cpu_seconds
+
+            cpu, rss = process_usage()
+            await logger.ainfo(
+                f"adapters: {', '.join(usage)}; process cpu: {(cpu - process_cpu) / timeout:.1%}"
+                f", memory: {rss / 2**20:.0f} MiB"
+            )
+            process_cpu = cpu
+
+
+class ProcessSupervisor:
+    """Runs groups of exchanges in child processes pinned to cores, a dead child is restarted on its own.
+
+    Every child is a complete screener for its exchanges, CPU and memory are read per child from /proc,
+    so the layout can be compared with the exchanges sharing one loop.
+    """
+
+    def __init__(
+        self,
+        groups: list[list[str]],
+        target: Callable[[int, list[str]], None],
+        restart_delay: float = settings.ADAPTER_RESTART_DELAY,
+    ) -> None:
+        self.groups = groups
+        self.target = target
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context("spawn")
+        self.processes: list[Any] = [None] * len(groups)
+        self.started = [0.0] * len(groups)
+        self.delays = [restart_delay] * len(groups)
+        self.restart_at = [0.0] * len(groups)
+        self.restarts = [0] * len(groups)
+
+    def name(self, index: int) -> str:
+        return ",".join(self.groups[index])
+
+    def start(self, index: int) -> None:
+        process = self.context.Process(
+            target=self.target, args=(index, self.groups[index]), name=f"screener-{self.name(index)}"
+        )
+        process.start()
+        self.processes[index] = process
+        self.started[index] = time.monotonic()
+
+    def stop(self) -> None:
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.kill()
+
+    async def run(self) -> None:
+        for index in range(len(self.groups)):
+            self.start(index)
+        try:
+            while True:
+                await asyncio.sleep(WATCH_INTERVAL)
+                await self.watch()
+        finally:
+            self.stop()
+
+    async def watch(self) -> None:
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            if not self.restart_at[index]:
+                if now - self.started[index] > HEALTHY_RUN:
+                    self.delays[index] = self.restart_delay
+                self.restart_at[index] = now + self.delays[index]
+                await logger.aerror(
+                    f"Process of {self.name(index)} exited with {process.exitcode}"
+                    f", restarting in {self.delays[index]}s"
+                )
+                self.delays[index] = min(self.delays[index] * 2, MAX_RESTART_DELAY)
+            elif now >= self.restart_at[index]:
+                self.restart_at[index] = 0.0
+                self.restarts[index] += 1
+                self.start(index)
+
+    def usage(self) -> list[tuple[float, int]]:
+        return [
+            process_usage(process.pid) if process is not None and process.is_alive() else (0.0, 0)
+            for process in self.processes
+        ]
+
+    def usage_by_group(self, field: int) -> dict[str, float]:
+        return {self.name(index): usage[field] for index, usage in enumerate(self.usage())}
+
+    def register_metrics(self) -> None:
+        collector.labelled_gauge(
+            "screener_process_cpu_seconds", "CPU time of the process", "exchanges", lambda: self.usage_by_group(0)
+        )
+        collector.labelled_gauge(
+            "screener_process_memory_bytes",
+            "Resident memory of the process",
+            "exchanges",
+            lambda: self.usage_by_group(1),
+        )
+        collector.labelled_gauge(
+            "screener_process_restarts",
+            "Restarts of the process",
+            "exchanges",
+            lambda: {self.name(index): restarts for index, restarts in enumerate(self.restarts)},
+        )
+
+    async def usage_watcher(self, timeout: int = 10) -> None:
+        previous = [0.0] * len(self.groups)
+        while True:
+            await asyncio.sleep(timeout)
+            usage = []
+            for index, (cpu, rss) in enumerate(self.usage()):
+                usage.append(
+                    f"{self.name(index)}: cpu {max(cpu - previous[index], 0) / timeout:.1%}"
+                    f", memory {rss / 2**20:.0f} MiB, restarts {self.restarts[index]}"
+                )
+                previous[index] = cpu
+            await logger.ainfo(f"processes: {'; '.join(usage)}")
+
+
+def exchange_groups(exchanges: list[str], processes: int) -> list[list[str]]:
+    groups: list[list[str]] = [[] for _ in range(min(processes, len(exchanges)))]
+    for index, exchange in enumerate(exchanges):
+        groups[index % len(groups)].append(exchange)
+    return groups
+
+
+def pin_to_core(index: int) -> None:
+    if not hasattr(os, "sched_setaffinity"):
+        return
+    cores = sorted(os.sched_getaffinity(0))
+    os.sched_setaffinity(0, {cores[index % len(cores)]})
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from typing import NamedTuple, Sequence
+
+from msgspec import Struct
+
+from core.metrics import bus_wait_seconds
+from settings import settings
+
+
+class Trade(Struct):
+    symbol: str
+    price: float
+    ts: int
+
+
+class BusStats(NamedTuple):
+    depth: int
+    capacity: int
+    paused: bool
+    published: int
+    dropped: int
+    drained_batches: int
+    last_batch: int
+    max_batch: int
+
+
+class TradeBus:
+    """Bounded ring of trades between the websocket adapters and the screener.
+
+    Producers are paused above the high watermark until the consumer drains the ring below the low
+    watermark, trades that don't fit into the ring at all are dropped and counted.
+    """
+
+    def __init__(
+        self,
+        capacity: int = settings.BUS_CAPACITY,
+        high_watermark: int = settings.BUS_HIGH_WATERMARK,
+        low_watermark: int = settings.BUS_LOW_WATERMARK,
+    ) -> None:
+        self.capacity = capacity
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.exchanges: list[str] = [""] * capacity
+        self.trades: list[Trade | None] = [None] * capacity
+        self.head = 0
+        self.size = 0
+        self.oldest_at = 0.0  # when the oldest trade still in the ring was published
+        self.readable = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+        self.published = 0
+        self.dropped = 0
+        self.drained_batches = 0
+        self.last_batch = 0
+        self.max_batch = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def publish(self, exchange: str, trades: Sequence[Trade]) -> int:
+        if (count := min(len(trades), self.capacity - self.size)) < len(trades):
+            self.dropped += len(trades) - count
+        if not count:
+            return 0
+
+        if not self.size:
+            self.oldest_at = time.monotonic()
+        tail = (self.head + self.size) % self.capacity
+        first = min(count, self.capacity - tail)
+        self.trades[tail : tail + first] = trades[:first]
+        self.exchanges[tail : tail + first] = [exchange] * first
+        if first < count:
+            self.trades[: count - first] = trades[first:count]
+            self.exchanges[: count - first] = [exchange] * (count - first)
+
+        self.size += count
+        self.published += count
+        if self.size >= self.high_watermark:
+            self.writable.clear()
+        self.readable.set()
+        return count
+
+    async def wait_writable(self, timeout: float = 1.0) -> None:
+        # don't block the producer forever, it still has to answer pings to keep the connection alive
+        if not self.writable.is_set():
+            try:
+                await asyncio.wait_for(self.writable.wait(), timeout)
+            except TimeoutError:
+                pass
+
+    async def drain(self, limit: int | None = None) -> tuple[list[str], list[Trade]]:
+        await self.readable.wait()
+
+        head, count = self.head, self.size if limit is None else min(self.size, limit)
+        end = min(head + count, self.capacity)
+        exchanges, trades = self.exchanges[head:end], self.trades[head:end]
+        # drained slots drop their trades, the ring must not keep them alive until it wraps around
+        self.trades[head:end] = [None] * (end - head)
+        if (wrapped := count - (end - head)) > 0:
+            exchanges += self.exchanges[:wrapped]
+            trades += self.trades[:wrapped]
+            self.trades[:wrapped] = [None] * wrapped
+
+        now = time.monotonic()
+        bus_wait_seconds.observe(now - self.oldest_at)
+        self.head = (head + count) % self.capacity
+        self.size -= count
+        # the rest of a partial drain is at least as old as the drain itself, close enough for a histogram
+        self.oldest_at = now
+        if not self.size:
+            self.readable.clear()
+        if self.size <= self.low_watermark:
+            self.writable.set()
+
+        self.drained_batches += 1
+        self.last_batch = count
+        self.max_batch = max(self.max_batch, count)
+        return exchanges, trades  # type: ignore
+
+    def stats(self) -> BusStats:
+        return BusStats(
+            depth=self.size,
+            capacity=self.capacity,
+            paused=not self.writable.is_set(),
+            published=self.published,
+            dropped=self.dropped,
+            drained_batches=self.drained_batches,
+            last_batch=self.last_batch,
+            max_batch=self.max_batch,
+        )
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import structlog
+
+from core.signals import max_period
+from core.streams_broker import market_partition, partitioned
+from core.windows import RollingWindows
+from settings import settings
+from worker import check_exchange, check_price_changes, fetch_ranges, handle_price_changes
+
+logger = structlog.getLogger(__name__)
+
+WARM_BATCH = 500  # markets per pipeline of history reads
+
+
+class CheckDispatcher:
+    def __init__(
+        self,
+        windows: RollingWindows,
+        interval: float = settings.CHECK_INTERVAL,
+        batch_size: int = settings.CHECK_BATCH_SIZE,
+    ) -> None:
+        self.windows = windows
+        self.interval = interval
+        self.batch_size = batch_size
+        self.dirty: set[str] = set()
+        self.dispatched_count = 0
+
+    def mark(self, market_key: str) -> None:
+        self.dirty.add(market_key)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.dirty:
+                continue
+
+            market_keys, self.dirty = self.dirty, set()
+            try:
+                if settings.LOCAL_WINDOWS:
+                    await self.warm_windows()
+                    await self.check_windows(market_keys)
+                elif settings.MRANGE_CHECKS:
+                    await self.dispatch_exchange_checks(market_keys)
+                else:
+                    await self.dispatch_checks(sorted(market_keys))
+            except Exception as err:
+                await logger.aerror(f"Failed to dispatch checks for {len(market_keys)} markets: {err}", exc_info=True)
+
+    async def warm_windows(self) -> None:
+        # windows of new markets (all of them after a restart) get the history the worker would read
+        cold = sorted(self.windows.cold)
+        now = time.time()
+        start_time, now_ms = (int(now) - max_period) * 1000, int(now * 1000)
+        for i in range(0, len(cold), WARM_BATCH):
+            market_keys = cold[i : i + WARM_BATCH]
+            try:
+                # compacted history comes as bucket points, counted like ticks until live ticks replace them
+                price_data, _ = await fetch_ranges(market_keys, start_time, now_ms)
+            except Exception as err:
+                await logger.awarning(f"Failed to warm up {len(market_keys)} windows, retrying: {err}")
+                return
+            for market_key, history in zip(market_keys, price_data, strict=True):
+                self.windows.warm(market_key, history)
+
+    async def check_windows(self, market_keys: set[str]) -> None:
+        now = time.time()
+        for market_key in market_keys:
+            if changes := self.windows.evaluate(market_key, now):
+                await partitioned(handle_price_changes, market_partition(market_key)).kiq(
+                    market_key, [list(change) for change in changes]
+                )
+                self.dispatched_count += 1
+
+    async def dispatch_checks(self, market_keys: list[str]) -> None:
+        # a batch never mixes partitions, so a market is only ever checked by the worker leasing its partition
+        partitions: dict[int, list[str]] = {}
+        for market_key in market_keys:
+            partitions.setdefault(market_partition(market_key), []).append(market_key)
+
+        for partition, keys in partitions.items():
+            for i in range(0, len(keys), self.batch_size):
+                await partitioned(check_price_changes, partition).kiq(keys[i : i + self.batch_size])
+                self.dispatched_count += 1
+
+    async def dispatch_exchange_checks(self, market_keys: set[str]) -> None:
+        symbols: dict[tuple[str, int], list[str]] = {}
+        for market_key in market_keys:
+            exchange, symbol = market_key.split("_", 1)
+            symbols.setdefault((exchange, market_partition(market_key)), []).append(symbol)
+
+        for (exchange, partition), exchange_symbols in symbols.items():
+            await partitioned(check_exchange, partition).kiq(exchange, sorted(exchange_symbols))
+            self.dispatched_count += 1
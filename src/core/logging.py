@@ -1,13 +1,48 @@
+import atexit
 import logging.config
-from json import dumps
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 import structlog
-from msgspec.json import Encoder
 
+from core.utils import dumps
 from settings import settings
 
-encoder = Encoder()
 logging.basicConfig(format="%(message)s", level=settings.LOGLEVEL)  # type: ignore
+log_level: int = logging.getLevelName(settings.LOGLEVEL.upper())
+listener: QueueListener | None = None
+
+
+class LogQueueHandler(QueueHandler):
+    """Hands records to the listener thread untouched, rendering and writing happen off the event loop."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the default prepare() formats the message here, the structlog formatters of the real handlers need the
+        # original event dict, records never leave the process so they don't have to be pickled either
+        return record
+
+
+def hot_path_log_rate() -> int:
+    """Every how many frames of an exchange the websocket hot path logs, 0 when debug logging is off."""
+    return settings.LOG_SAMPLE_RATE if log_level <= logging.DEBUG else 0
+
+
+def start_log_queue(loggers: list[str]) -> None:
+    global listener
+    if listener is not None:
+        # a stopped listener can't be stopped again at exit
+        atexit.unregister(listener.stop)
+        listener.stop()
+
+    handlers, queue_handler = [], LogQueueHandler(queue.SimpleQueue())
+    for name in loggers:
+        std_logger = logging.getLogger(name)
+        handlers.extend(handler for handler in std_logger.handlers if handler not in handlers)
+        std_logger.handlers = [queue_handler]
+
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
 
 def setup_logging(cache_logger_on_first_use: bool = True) -> None:
@@ -32,11 +67,11 @@ def setup_logging(cache_logger_on_first_use: bool = True) -> None:
 
     structlog_conf = {
         "processors": [
-            structlog.stdlib.filter_by_level,
             *processors,
             structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
         ],
-        "wrapper_class": structlog.stdlib.BoundLogger,
+        # filtered calls return right away, disabled `await logger.adebug()` doesn't hop to the executor anymore
+        "wrapper_class": structlog.make_filtering_bound_logger(log_level),
         "logger_factory": structlog.stdlib.LoggerFactory(),
         "cache_logger_on_first_use": cache_logger_on_first_use,
     }
@@ -102,3 +137,5 @@ def setup_logging(cache_logger_on_first_use: bool = True) -> None:
         },
     }
     logging.config.dictConfig(std_logging_conf)
+    if settings.LOG_QUEUE:
+        start_log_queue(list(std_logging_conf["loggers"]))
@@ -0,0 +1,49 @@
+import sys
+
+
+class MarketStore:
+    # Per-market ingest state as parallel columns indexed by an interned market id. Plain lists are used on
+    # purpose: array("d") boxes a new float on every read and is slower than the dicts it replaces.
+
+    def __init__(self) -> None:
+        self.ids: dict[str, dict[str, int]] = {}
+        self.keys: list[str] = []
+        self.prices: list[float] = []
+        self.saved_ts: list[int] = []
+        self.trade_ts: list[int] = []
+        self.free_ids: list[int] = []  # ids of evicted markets, reused before the columns grow
+
+    def __len__(self) -> int:
+        return len(self.keys) - len(self.free_ids)
+
+    def symbol_ids(self, exchange: str) -> dict[str, int]:
+        if (symbol_ids := self.ids.get(exchange)) is None:
+            symbol_ids = self.ids[exchange] = {}
+        return symbol_ids
+
+    def add(self, exchange: str, symbol: str, timestamp: int = 0) -> int:
+        market_key = sys.intern(f"{exchange}_{symbol}")
+        if self.free_ids:
+            market_id = self.free_ids.pop()
+            self.keys[market_id] = market_key
+            self.prices[market_id] = 0.0
+            self.saved_ts[market_id] = 0
+            self.trade_ts[market_id] = timestamp
+        else:
+            market_id = len(self.keys)
+            self.keys.append(market_key)
+            self.prices.append(0.0)
+            self.saved_ts.append(0)
+            self.trade_ts.append(timestamp)
+        self.symbol_ids(exchange)[sys.intern(symbol)] = market_id
+        return market_id
+
+    def remove_idle(self, cutoff_ts: int) -> list[str]:
+        trade_ts, market_keys = self.trade_ts, []
+        for symbol_ids in self.ids.values():
+            for symbol in [symbol for symbol, market_id in symbol_ids.items() if trade_ts[market_id] < cutoff_ts]:
+                market_id = symbol_ids.pop(symbol)
+                market_keys.append(self.keys[market_id])
+                self.keys[market_id] = ""
+                self.free_ids.append(market_id)
+        return market_keys
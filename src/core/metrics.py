@@ -0,0 +1,141 @@
+from typing import Callable, Iterator
+
+from prometheus_client import Histogram, start_http_server
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+from prometheus_client.registry import Collector
+
+from settings import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DECODE_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 1e-2)
+
+decode_seconds = Histogram(
+    "screener_frame_decode_seconds", "Decode time of a websocket frame (sampled)", ["exchange"], buckets=DECODE_BUCKETS
+)
+exchange_latency_seconds = Histogram(
+    "screener_exchange_latency_seconds",
+    "Delay between the trade timestamp of the exchange and its receipt (sampled)",
+    ["exchange"],
+    buckets=LATENCY_BUCKETS,
+)
+bus_wait_seconds = Histogram(
+    "screener_bus_wait_seconds", "Wait of the oldest trade of a drained batch", buckets=LATENCY_BUCKETS
+)
+redis_write_seconds = Histogram(
+    "screener_redis_write_seconds", "Latency of a TS.MADD pipeline to Redis", buckets=LATENCY_BUCKETS
+)
+
+
+class ExchangeStats:
+    """Hot path counters of one exchange.
+
+    Counting a frame or a trade is a plain integer add, the values are read by the collector on scrape.
+    Histograms are pre-bound to the exchange label and observed for every `METRICS_SAMPLE_RATE`-th frame only,
+    CPU time is measured on the same frames and scaled up.
+    """
+
+    __slots__ = (
+        "exchange",
+        "frames",
+        "trades",
+        "reconnects",
+        "restarts",
+        "cpu_seconds",
+        "decode_seconds",
+        "latency_seconds",
+    )
+
+    def __init__(self, exchange: str) -> None:
+        self.exchange = exchange
+        self.frames = 0
+        self.trades = 0
+        self.reconnects = 0
+        self.restarts = 0
+        self.cpu_seconds = 0.0
+        self.decode_seconds = decode_seconds.labels(exchange)
+        self.latency_seconds = exchange_latency_seconds.labels(exchange)
+
+
+class ScreenerCollector(Collector):
+    """Exposes counters kept as plain attributes by the ingest process, read only when Prometheus scrapes."""
+
+    def __init__(self) -> None:
+        self.exchanges: dict[str, ExchangeStats] = {}
+        self.counters: dict[str, tuple[str, Callable[[], float]]] = {}
+        self.gauges: dict[str, tuple[str, Callable[[], float]]] = {}
+        self.labelled: dict[str, tuple[str, str, Callable[[], dict[str, float]]]] = {}
+        self.histograms: list[tuple[Histogram, Callable[[], list[float]]]] = []
+
+    def exchange_stats(self, exchange: str) -> ExchangeStats:
+        if (stats := self.exchanges.get(exchange)) is None:
+            stats = self.exchanges[exchange] = ExchangeStats(exchange)
+        return stats
+
+    def counter(self, name: str, documentation: str, read: Callable[[], float]) -> None:
+        self.counters[name] = (documentation, read)
+
+    def gauge(self, name: str, documentation: str, read: Callable[[], float]) -> None:
+        self.gauges[name] = (documentation, read)
+
+    def labelled_gauge(self, name: str, documentation: str, label: str, read: Callable[[], dict[str, float]]) -> None:
+        self.labelled[name] = (documentation, label, read)
+
+    def histogram(self, histogram: Histogram, read: Callable[[], list[float]]) -> None:
+        """Exposes a histogram with the observations of other processes added, `read` as from histogram_values()."""
+        # the collector exposes it instead, the name must not show up twice
+        REGISTRY.unregister(histogram)
+        self.histograms.append((histogram, read))
+
+    def collect(self) -> Iterator[CounterMetricFamily | GaugeMetricFamily | HistogramMetricFamily]:
+        frames = CounterMetricFamily("screener_frames", "Websocket frames received", labels=["exchange"])
+        trades = CounterMetricFamily("screener_trades", "Trades decoded from the websockets", labels=["exchange"])
+        reconnects = CounterMetricFamily("screener_reconnects", "Websocket reconnects", labels=["exchange"])
+        restarts = CounterMetricFamily("screener_adapter_restarts", "Restarts of a failed adapter", labels=["exchange"])
+        cpu = CounterMetricFamily(
+            "screener_exchange_cpu_seconds", "CPU time of decoding and publishing trades (sampled)", labels=["exchange"]
+        )
+        for exchange, stats in self.exchanges.items():
+            frames.add_metric([exchange], stats.frames)
+            trades.add_metric([exchange], stats.trades)
+            reconnects.add_metric([exchange], stats.reconnects)
+            restarts.add_metric([exchange], stats.restarts)
+            cpu.add_metric([exchange], stats.cpu_seconds)
+        yield from (frames, trades, reconnects, restarts, cpu)
+
+        for name, (documentation, read) in self.counters.items():
+            yield CounterMetricFamily(name, documentation, value=read())
+        for name, (documentation, read) in self.gauges.items():
+            yield GaugeMetricFamily(name, documentation, value=read())
+        for name, (documentation, label, read) in self.labelled.items():
+            family = GaugeMetricFamily(name, documentation, labels=[label])
+            for value, metric in read().items():
+                family.add_metric([value], metric)
+            yield family
+        for histogram, read in self.histograms:
+            metric = histogram.collect()[0]
+            bounds = [sample.labels["le"] for sample in metric.samples if sample.name.endswith("_bucket")]
+            values = [own + other for own, other in zip(histogram_values(histogram), read(), strict=True)]
+            yield HistogramMetricFamily(
+                metric.name,
+                metric.documentation,
+                buckets=list(zip(bounds, values[:-1], strict=True)),
+                sum_value=values[-1],
+            )
+
+
+def histogram_values(histogram: Histogram) -> list[float]:
+    """Cumulative bucket counts of an unlabelled histogram (+Inf last) followed by the sum of the observations."""
+    samples = histogram.collect()[0].samples
+    return [
+        *(sample.value for sample in samples if sample.name.endswith("_bucket")),
+        next(sample.value for sample in samples if sample.name.endswith("_sum")),
+    ]
+
+
+collector = ScreenerCollector()
+REGISTRY.register(collector)
+
+
+def start_metrics_server(port: int = settings.METRICS_PORT) -> None:
+    if port:
+        start_http_server(port)
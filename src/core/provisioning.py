@@ -0,0 +1,67 @@
+import structlog
+
+from core.redis import COMPACTIONS, redis
+from core.signals import max_period
+from settings import settings
+
+logger = structlog.getLogger(__name__)
+
+PROVISION_BATCH = 500  # markets per pipeline
+SIGNALS_RETENTION = 60 * 60 * 24 * 1000
+IGNORED_ERRORS = ("already exists", "already has a src rule")
+
+
+def market_series(exchange: str, symbol: str) -> list[tuple[str, int, dict[str, str]]]:
+    market_key = f"{exchange}_{symbol}"
+    labels = {"exchange": exchange, "symbol": symbol}
+    if not (bucket_ms := settings.COMPACTION_BUCKET_MS):
+        series = [(market_key, max_period * 1000, labels | {"type": "trades"})]
+    else:
+        # raw ticks only have to outlive the bucket that is still open, checks read the compacted series
+        series = [(market_key, settings.COMPACTION_RAW_RETENTION * 1000, labels | {"type": "trades"})]
+        series.extend(
+            (
+                f"{market_key}_{aggregation}",
+                max_period * 1000 + bucket_ms,
+                labels | {"type": "compacted", "aggregation": aggregation},
+            )
+            for aggregation in COMPACTIONS
+        )
+    series.append((f"{market_key}_signals", SIGNALS_RETENTION, labels | {"type": "signals"}))
+    return series
+
+
+async def provision_markets(markets: list[tuple[str, str]]) -> None:
+    """Creates the series of the markets (and their compaction rules) in pipelined batches.
+
+    Safe to call for markets that already exist: TS.CREATE of an existing series fails with "already exists",
+    such series get a TS.ALTER instead, so series created by older versions pick up the current labels and retention.
+    """
+    for i in range(0, len(markets), PROVISION_BATCH):
+        await provision_batch(markets[i : i + PROVISION_BATCH])
+
+
+async def provision_batch(markets: list[tuple[str, str]]) -> None:
+    series = [item for exchange, symbol in markets for item in market_series(exchange, symbol)]
+    async with redis.pipeline(transaction=False) as pipe:
+        for key, retention, labels in series:
+            pipe.ts().create(key, retention_msecs=retention, duplicate_policy="last", labels=labels)
+        if bucket_ms := settings.COMPACTION_BUCKET_MS:
+            for market_key in (f"{exchange}_{symbol}" for exchange, symbol in markets):
+                for aggregation in COMPACTIONS:
+                    pipe.ts().createrule(market_key, f"{market_key}_{aggregation}", aggregation, bucket_ms)
+        results = await pipe.execute(raise_on_error=False)
+
+    # replies of the compaction rules follow the series, zip() stops at the series
+    if existing := [item for item, result in zip(series, results, strict=False) if is_ignored(result)]:
+        async with redis.pipeline(transaction=False) as pipe:
+            for key, retention, labels in existing:
+                pipe.ts().alter(key, retention_msecs=retention, labels=labels)
+            results += await pipe.execute(raise_on_error=False)
+
+    if errors := [result for result in results if isinstance(result, Exception) and not is_ignored(result)]:
+        await logger.aerror(f"Failed to provision {len(errors)} series: {errors[0]}")
+
+
+def is_ignored(result: object) -> bool:
+    return isinstance(result, Exception) and any(error in str(result) for error in IGNORED_ERRORS)
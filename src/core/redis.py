@@ -4,3 +4,11 @@ from settings import settings
 
 redis = from_url(settings.REDIS_URI, decode_responses=True)
 time_series = redis.ts()
+
+# aggregations kept per market in compaction mode, see settings.COMPACTION_BUCKET_MS; the tick count of a
+# bucket lets the worker count the ticks of a window like the raw series does
+PRICE_COMPACTIONS = ("first", "min", "max", "last")
+COMPACTIONS = (*PRICE_COMPACTIONS, "count")
+
+# workers drop their cached signal state of the markets published here, see core.signal_state
+INVALIDATION_CHANNEL = "screener:invalidate"
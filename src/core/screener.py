@@ -1,99 +1,166 @@
 import asyncio
+import random
 import time
-from asyncio import Queue
 
 import structlog
 
-from core.redis import redis, time_series
+from core.bus import Trade, TradeBus
+from core.dispatcher import CheckDispatcher
+from core.markets import MarketStore
+from core.metrics import collector
+from core.redis import COMPACTIONS, INVALIDATION_CHANNEL, redis
+from core.signals import check_ranges
+from core.windows import RollingWindows
+from core.writer import TimeSeriesWriter
 from settings import settings
-from worker import check_price_change
 
 logger = structlog.getLogger(__name__)
 
+UNLINK_BATCH = 1000
+FOOTPRINT_SAMPLE = 100  # markets whose keys are counted for the footprint
 
-class Screener:
-    symbol_prices: dict
-    trades_count: int = 0
 
+class Screener:
     def __init__(self, time_frame: str = "ms"):
         self.time_frame = time_frame
-        self.symbol_prices = {}
+        # monotonic, readers diff them against their previous reading
+        self.trades_count = 0
+        self.skipped_count = 0
+        self.evicted_count = 0
+        self.markets = MarketStore()
         self.exchange = "Bybit"
-        self.check_ranges = [
-            {"period": int(signal[0]) * 60, "threshold": float(signal[1])}
-            for signal in [d.split(",") for d in settings.SIGNAL_THRESHOLDS]
-        ]
+        self.windows = RollingWindows()
+        self.writer = TimeSeriesWriter()
+        self.dispatcher = CheckDispatcher(self.windows)
 
-    async def process_trades(self, trades_queue: Queue) -> None:
+    async def process_trades(self, bus: TradeBus) -> None:
         while True:
-            market_key: str = ""
-            message = await trades_queue.get()
-            trades_queue.task_done()
-            pass_multiplier = round((trades_queue.qsize() // 500) / 10, 1)
-            exchange = message["exchange"]
-            for trade in message["data"]:
-                symbol = trade["s"]
-                price = float(trade["p"])
-                timestamp = int(trade["T"])
-
-                market_key = f"{exchange}_{symbol}"
-                self.trades_count += 1
-
-                if not (market_data := self.symbol_prices.get(market_key, {})):
-                    try:
-                        await self.create_timeseries(market_key)
-                        market_data = self.symbol_prices[market_key]
-                    except Exception as err:
-                        await logger.aerror(f"Failed to create timeseries for {market_key}: {err}", exc_info=True)
-
-                if (
-                    market_data.get("price", 0) == price
-                    or market_data.get("saved_ts", 0) == timestamp
-                    or market_data.get("saved_ts", 0) > int((time.time() - pass_multiplier) * 1000)
-                ):
-                    continue
-
-                try:
-                    await time_series.add(market_key, timestamp, price, duplicate_policy="last")
-                    market_data["saved_ts"] = timestamp
-                except Exception as err:
-                    await logger.aerror(f"Failed to write {market_key} price to Redis: {err}", exc_info=True)
-
-                market_data["price"] = price
-                market_data["timestamp"] = timestamp
-
-            if not market_key:
+            exchanges, trades = await bus.drain()
+            # price writes are throttled by 0.1s per tenth of the high watermark the backlog reached, up to 1s
+            backlog = (len(trades) + len(bus)) / bus.high_watermark
+            pass_multiplier = round(min(backlog, 1.0), 1)
+            await self.process_batch(exchanges, trades, pass_multiplier)
+
+    async def process_batch(self, exchanges: list[str], trades: list[Trade], pass_multiplier: float) -> None:
+        exchange, symbol_ids, keys = "", {}, self.markets.keys
+        prices, saved_ts, trade_ts = self.markets.prices, self.markets.saved_ts, self.markets.trade_ts
+        throttle_ts = int((time.time() - pass_multiplier) * 1000)
+        self.trades_count += len(trades)
+        written = 0
+
+        for trade_exchange, trade in zip(exchanges, trades, strict=True):
+            if trade_exchange is not exchange:
+                exchange, symbol_ids = trade_exchange, self.markets.symbol_ids(trade_exchange)
+            symbol, price, timestamp = trade.symbol, trade.price, trade.ts
+
+            if (market_id := symbol_ids.get(symbol)) is None:
+                market_id = self.add_market(exchange, symbol)
+
+            trade_ts[market_id] = timestamp
+            if prices[market_id] == price or saved_ts[market_id] == timestamp or saved_ts[market_id] > throttle_ts:
                 continue
 
-            await check_price_change.kiq(market_key)
+            market_key = keys[market_id]
+            self.writer.add(market_key, timestamp, price)
+            saved_ts[market_id] = timestamp
+            prices[market_id] = price
+            if settings.LOCAL_WINDOWS:
+                self.windows.add(market_key, timestamp, price)
+            self.dispatcher.mark(market_key)
+            written += 1
 
-    async def create_timeseries(self, symbol: str) -> None:
-        try:
-            self.symbol_prices[symbol] = {}
-            if not await redis.exists(symbol):
-                max_retention = max([check_range["period"] for check_range in self.check_ranges]) * 1000
-                await time_series.create(symbol, retention_msecs=max_retention, duplicate_policy="last")
-        except Exception as err:
-            if "already exists" not in str(err):
-                await logger.aerror(err)
+        self.skipped_count += len(trades) - written
 
-        max_signal_retention = int((60 * 60 * 24) * 1000)
-        try:
-            if not await redis.exists(f"{symbol}_signals"):
-                await time_series.create(
-                    f"{symbol}_signals", retention_msecs=max_signal_retention, duplicate_policy="last"
-                )
-        except Exception as err:
-            if "already exists" not in str(err):
-                await logger.aerror(err)
+    def add_market(self, exchange: str, symbol: str) -> int:
+        # series are provisioned in bulk when the adapters connect, see core.provisioning
+        return self.markets.add(exchange, symbol, int(time.time() * 1000))
 
-    async def state_watcher(self, trades_queue: Queue, timeout=10):
+    async def sweeper(self, interval: int = settings.CLEAR_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep_idle_markets(int((time.time() - settings.MARKET_IDLE_TIMEOUT) * 1000))
+            except Exception as err:
+                await logger.aerror(f"Failed to sweep idle markets: {err}", exc_info=True)
+
+    async def sweep_idle_markets(self, cutoff_ts: int) -> None:
+        # in-process state goes first and without awaits, so process_batch never sees a half evicted market
+        if not (market_keys := self.markets.remove_idle(cutoff_ts)):
+            return
+        for market_key in market_keys:
+            self.windows.remove(market_key)
+            self.dispatcher.dirty.discard(market_key)
+        self.evicted_count += len(market_keys)
+
+        keys = [key for market_key in market_keys for key in market_redis_keys(market_key)]
+        async with redis.pipeline(transaction=False) as pipe:
+            for i in range(0, len(keys), UNLINK_BATCH):
+                pipe.unlink(*keys[i : i + UNLINK_BATCH])
+            for market_key in market_keys:
+                pipe.publish(INVALIDATION_CHANNEL, market_key)
+            await pipe.execute()
+        await logger.ainfo(f"Evicted {len(market_keys)} idle markets", markets=market_keys[:20])
+
+    def register_metrics(self, bus: TradeBus) -> None:
+        collector.counter("screener_trades_processed", "Trades processed by the screener", lambda: self.trades_count)
+        collector.counter(
+            "screener_trades_skipped", "Trades not written: unchanged price or throttled", lambda: self.skipped_count
+        )
+        collector.counter("screener_prices_written", "Prices written to Redis", lambda: self.writer.written_count)
+        collector.counter("screener_prices_failed", "Prices failed to write to Redis", lambda: self.writer.failed_count)
+        collector.counter(
+            "screener_prices_dropped", "Prices dropped by a full write buffer", lambda: self.writer.dropped_count
+        )
+        collector.gauge("screener_markets", "Markets tracked", lambda: len(self.markets))
+        collector.counter("screener_markets_evicted", "Idle markets evicted", lambda: self.evicted_count)
+        collector.counter(
+            "screener_checks_dispatched", "Check tasks sent to the workers", lambda: self.dispatcher.dispatched_count
+        )
+        register_bus_metrics(bus)
+
+    async def state_watcher(self, bus: TradeBus, timeout: int = 10) -> None:
+        exch = ",".join(settings.EXCHANGES)
+        processed = 0
         while True:
-            tqsize = trades_queue.qsize()
-            exch = ",".join(settings.EXCHANGES)
+            stats = bus.stats()
+            # read once, process_batch keeps counting while the log line is written
+            total = self.trades_count
             await logger.ainfo(
-                f"[{exch}] queue: {tqsize}, trades processed: {self.trades_count / timeout}/sec"
-                f", markets: {len(self.symbol_prices)}"
+                f"[{exch}] bus: {stats.depth}/{stats.capacity}{' (paused)' if stats.paused else ''}"
+                f", dropped: {stats.dropped}, batch: {stats.last_batch} (max {stats.max_batch})"
+                f", trades processed: {(total - processed) / timeout}/sec, markets: {len(self.markets)}"
+                f" (evicted {self.evicted_count}), {await self.key_footprint()}"
             )
-            self.trades_count = 0
+            processed = total
             await asyncio.sleep(timeout)
+
+    async def key_footprint(self) -> str:
+        # the database is shared with the other exchanges and the worker, only the keys of our markets count
+        market_keys = [market_key for market_key in self.markets.keys if market_key]
+        if not market_keys:
+            return "redis keys: 0"
+        sample = random.sample(market_keys, min(len(market_keys), FOOTPRINT_SAMPLE))
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for market_key in sample:
+                    pipe.exists(*market_redis_keys(market_key))
+                counts = await pipe.execute()
+        except Exception as err:
+            return f"redis keys: n/a ({err})"
+        per_market = sum(counts) / len(sample)
+        return f"redis keys: ~{per_market * len(market_keys):.0f} ({per_market:.1f}/market)"
+
+
+def market_redis_keys(market_key: str) -> list[str]:
+    # _check_ts and _last_percent expire on their own, they are listed for keys written before they had a TTL
+    keys = [market_key, f"{market_key}_signals", f"{market_key}_check_ts"]
+    keys.extend(f"{market_key}_{check_range['period']}_last_percent" for check_range in check_ranges)
+    if settings.COMPACTION_BUCKET_MS:
+        keys.extend(f"{market_key}_{aggregation}" for aggregation in COMPACTIONS)
+    return keys
+
+
+def register_bus_metrics(bus: TradeBus) -> None:
+    collector.gauge("screener_bus_depth", "Trades waiting in the bus", lambda: bus.size)
+    collector.gauge("screener_bus_paused", "Adapters paused by the bus", lambda: not bus.writable.is_set())
+    collector.counter("screener_bus_dropped", "Trades dropped by a full bus", lambda: bus.dropped)
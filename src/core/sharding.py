@@ -0,0 +1,239 @@
+import asyncio
+import multiprocessing
+import queue
+import signal
+import time
+import zlib
+from functools import partial
+from multiprocessing.sharedctypes import SynchronizedArray
+from typing import Any
+
+import structlog
+import uvloop
+from msgspec import msgpack
+
+from core.bus import Trade, TradeBus
+from core.logging import setup_logging
+from core.metrics import bus_wait_seconds, collector, histogram_values, redis_write_seconds
+from core.screener import Screener, register_bus_metrics
+from settings import settings
+
+logger = structlog.getLogger(__name__)
+
+# trades processed, markets tracked, trades dropped, trades skipped, prices written, prices failed,
+# prices dropped by the writer, markets evicted, check tasks dispatched
+STATS_FIELDS = 9
+# histograms observed in the shards, their values are added to the ones of the router process
+SHARD_HISTOGRAMS = (bus_wait_seconds, redis_write_seconds)
+HISTOGRAM_FIELDS = sum(len(histogram_values(histogram)) for histogram in SHARD_HISTOGRAMS)
+STATS_INTERVAL = 1.0
+STOP_POLL_INTERVAL = 0.1
+
+
+class ShardTrade(Trade, array_like=True):
+    pass
+
+
+encoder = msgpack.Encoder()
+decoder = msgpack.Decoder(list[tuple[str, list[ShardTrade]]])
+
+
+def shard_index(market_key: str, shards: int) -> int:
+    # hash() is salted per process, crc32 keeps the market -> shard mapping stable across restarts
+    return zlib.crc32(market_key.encode()) % shards
+
+
+class ShardRouter:
+    def __init__(self, shards: int = settings.SCREENER_SHARDS) -> None:
+        self.shards = shards
+        self.context = multiprocessing.get_context("spawn")
+        self.queues = [self.context.Queue(maxsize=settings.SHARD_QUEUE_SIZE) for _ in range(shards)]
+        self.stats: SynchronizedArray = self.context.Array("q", shards * STATS_FIELDS)
+        self.histograms: SynchronizedArray = self.context.Array("d", shards * HISTOGRAM_FIELDS)
+        self.processes: list[Any] = []
+        self.routes: dict[str, dict[str, int]] = {}
+        self.dropped = 0
+
+    def start(self) -> None:
+        for index, shard_queue in enumerate(self.queues):
+            process = self.context.Process(
+                target=run_shard,
+                args=(index, shard_queue, self.stats, self.histograms),
+                name=f"screener-shard-{index}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        for shard_queue in self.queues:
+            try:
+                shard_queue.put_nowait(None)
+            except queue.Full:
+                pass
+        # the shards wind down together against one deadline, polled so that the event loop keeps running
+        deadline = time.monotonic() + timeout
+        while any(process.is_alive() for process in self.processes) and time.monotonic() < deadline:
+            await asyncio.sleep(STOP_POLL_INTERVAL)
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+
+    def route(self, exchange: str, symbol: str) -> int:
+        if (routes := self.routes.get(exchange)) is None:
+            routes = self.routes[exchange] = {}
+        if (shard := routes.get(symbol)) is None:
+            shard = routes[symbol] = shard_index(f"{exchange}_{symbol}", self.shards)
+        return shard
+
+    async def run(self, bus: TradeBus) -> None:
+        self.start()
+        try:
+            while True:
+                exchanges, trades = await bus.drain()
+                self.dispatch(exchanges, trades)
+        finally:
+            await self.stop()
+
+    def dispatch(self, exchanges: list[str], trades: list[Trade]) -> None:
+        batches: list[dict[str, list[tuple[str, float, int]]]] = [{} for _ in range(self.shards)]
+        for exchange, trade in zip(exchanges, trades, strict=True):
+            shard_batch = batches[self.route(exchange, trade.symbol)]
+            if (exchange_trades := shard_batch.get(exchange)) is None:
+                exchange_trades = shard_batch[exchange] = []
+            exchange_trades.append((trade.symbol, trade.price, trade.ts))
+
+        for shard_queue, shard_batch in zip(self.queues, batches, strict=True):
+            if not shard_batch:
+                continue
+            try:
+                shard_queue.put_nowait(encoder.encode(list(shard_batch.items())))
+            except queue.Full:
+                self.dropped += sum(len(exchange_trades) for exchange_trades in shard_batch.values())
+
+    def shard_total(self, field: int) -> int:
+        return sum(self.stats[field::STATS_FIELDS])
+
+    def shard_histogram(self, offset: int, fields: int) -> list[float]:
+        values = [0.0] * fields
+        for shard in range(self.shards):
+            start = shard * HISTOGRAM_FIELDS + offset
+            values = [
+                total + value for total, value in zip(values, self.histograms[start : start + fields], strict=True)
+            ]
+        return values
+
+    def register_metrics(self, bus: TradeBus) -> None:
+        collector.counter("screener_trades_processed", "Trades processed by the screener", partial(self.shard_total, 0))
+        collector.counter(
+            "screener_trades_skipped", "Trades not written: unchanged price or throttled", partial(self.shard_total, 3)
+        )
+        collector.counter(
+            "screener_shard_dropped", "Trades dropped by full shard queues", lambda: self.dropped + self.shard_total(2)
+        )
+        collector.counter("screener_prices_written", "Prices written to Redis", partial(self.shard_total, 4))
+        collector.counter("screener_prices_failed", "Prices failed to write to Redis", partial(self.shard_total, 5))
+        collector.counter(
+            "screener_prices_dropped", "Prices dropped by a full write buffer", partial(self.shard_total, 6)
+        )
+        collector.gauge("screener_markets", "Markets tracked", partial(self.shard_total, 1))
+        collector.counter("screener_markets_evicted", "Idle markets evicted", partial(self.shard_total, 7))
+        collector.counter("screener_checks_dispatched", "Check tasks sent to the workers", partial(self.shard_total, 8))
+        offset = 0
+        for histogram in SHARD_HISTOGRAMS:
+            fields = len(histogram_values(histogram))
+            collector.histogram(histogram, partial(self.shard_histogram, offset, fields))
+            offset += fields
+        collector.gauge("screener_shards_alive", "Alive screener shard processes", self.alive)
+        register_bus_metrics(bus)
+
+    def alive(self) -> int:
+        return sum(process.is_alive() for process in self.processes)
+
+    async def state_watcher(self, bus: TradeBus, timeout: int = 10) -> None:
+        exch = ",".join(settings.EXCHANGES)
+        processed = 0
+        while True:
+            stats = bus.stats()
+            shards = [self.stats[i * STATS_FIELDS : (i + 1) * STATS_FIELDS] for i in range(self.shards)]
+            total = sum(shard[0] for shard in shards)
+            await logger.ainfo(
+                f"[{exch}] bus: {stats.depth}/{stats.capacity}{' (paused)' if stats.paused else ''}"
+                f", dropped: {stats.dropped + self.dropped + sum(shard[2] for shard in shards)}"
+                f", trades processed: {(total - processed) / timeout}/sec"
+                f", markets: {sum(shard[1] for shard in shards)}, shards: {self.shards}"
+                f" (alive {self.alive()})"
+            )
+            processed = total
+            await asyncio.sleep(timeout)
+
+
+def run_shard(index: int, shard_queue: Any, stats: SynchronizedArray, histograms: SynchronizedArray) -> None:
+    setup_logging()
+    structlog.contextvars.bind_contextvars(shard=index)
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        runner.run(shard_main(index, shard_queue, stats, histograms))
+
+
+async def shard_main(index: int, shard_queue: Any, stats: SynchronizedArray, histograms: SynchronizedArray) -> None:
+    bus = TradeBus()
+    screener = Screener()
+    tasks = [
+        asyncio.create_task(screener.process_trades(bus)),
+        asyncio.create_task(screener.writer.run()),
+        asyncio.create_task(screener.dispatcher.run()),
+        asyncio.create_task(publish_stats(index, screener, bus, stats, histograms)),
+    ]
+    if settings.MARKET_IDLE_TIMEOUT:
+        tasks.append(asyncio.create_task(screener.sweeper()))
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(sig, lambda: [task.cancel() for task in tasks])
+
+    await logger.ainfo(f"Screener shard {index} started")
+    reader = asyncio.create_task(receive_trades(shard_queue, bus))
+    await asyncio.wait([reader, *tasks], return_when=asyncio.FIRST_COMPLETED)
+    for task in (reader, *tasks):
+        task.cancel()
+    await asyncio.gather(reader, *tasks, return_exceptions=True)
+
+
+async def receive_trades(shard_queue: Any, bus: TradeBus) -> None:
+    loop = asyncio.get_running_loop()
+    get_payload = partial(shard_queue.get, timeout=1.0)
+    while True:
+        try:
+            payload = await loop.run_in_executor(None, get_payload)
+        except queue.Empty:
+            # a short timeout lets the shard notice when the adapter process is gone
+            if not (parent := multiprocessing.parent_process()) or not parent.is_alive():
+                return
+            continue
+
+        if payload is None:
+            return
+        for exchange, trades in decoder.decode(payload):
+            bus.publish(exchange, trades)
+
+
+async def publish_stats(
+    index: int, screener: Screener, bus: TradeBus, stats: SynchronizedArray, histograms: SynchronizedArray
+) -> None:
+    # shards serve no metrics themselves, the router process exposes their counters and histograms
+    offset = index * STATS_FIELDS
+    histogram_offset = index * HISTOGRAM_FIELDS
+    while True:
+        stats[offset : offset + STATS_FIELDS] = [
+            screener.trades_count,
+            len(screener.markets),
+            bus.dropped,
+            screener.skipped_count,
+            screener.writer.written_count,
+            screener.writer.failed_count,
+            screener.writer.dropped_count,
+            screener.evicted_count,
+            screener.dispatcher.dispatched_count,
+        ]
+        histograms[histogram_offset : histogram_offset + HISTOGRAM_FIELDS] = [
+            value for histogram in SHARD_HISTOGRAMS for value in histogram_values(histogram)
+        ]
+        await asyncio.sleep(STATS_INTERVAL)
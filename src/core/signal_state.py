@@ -0,0 +1,202 @@
+import asyncio
+from collections import OrderedDict
+
+import structlog
+from prometheus_client import Counter
+from redis.exceptions import ResponseError
+
+from core.redis import INVALIDATION_CHANNEL, redis
+from core.signals import PriceChange
+from settings import settings
+
+logger = structlog.getLogger(__name__)
+
+DAY_MS = 60 * 60 * 24 * 1000
+TTL_MARGIN = 1.0  # seconds, cached entries expire a bit before their keys do
+
+cache_lookups = Counter("screener_signal_cache_lookups", "Signal state cache lookups of the worker", ["result"])
+
+# The whole signal decision of a market runs as one atomic call, so concurrent workers can't both see an
+# empty last percent key and send the same alert twice.
+LIBRARY = """#!lua name=screener
+
+-- KEYS: check ts key, signals series, then the last percent key of every price change
+-- ARGV: now (s), check timeout (s), now (ms), 24h ago (ms), then percent and ttl of every price change
+-- Returns the check ts followed by {decision, signals, last percent, ttl} of every price change, numbers that
+-- may be fractional are returned as strings, Redis would truncate them to integers
+local function signal_decisions(keys, args)
+    local now, check_timeout = tonumber(args[1]), tonumber(args[2])
+    local decisions = {''}
+
+    if check_timeout > 0 then
+        local check_ts = redis.call('GET', keys[1])
+        if check_ts and tonumber(check_ts) > now - check_timeout then
+            decisions[1] = check_ts
+            for _ = 3, #keys do
+                decisions[#decisions + 1] = {'nothing', 0, '', 0}
+            end
+            return decisions
+        end
+        redis.call('SET', keys[1], args[1], 'EX', math.ceil(check_timeout))
+        decisions[1] = args[1]
+    end
+
+    for i = 3, #keys do
+        local percent, ttl = args[2 * i - 1], tonumber(args[2 * i])
+        local last_percent = tonumber(redis.call('GET', keys[i]) or '0')
+        if last_percent ~= 0 then
+            local remaining = redis.call('TTL', keys[i])
+            if remaining > 0 then
+                ttl = remaining
+            end
+        end
+
+        local signals = redis.pcall('TS.RANGE', keys[2], args[4], args[3])
+        signals = (type(signals) == 'table' and signals.err == nil) and #signals or 0
+
+        if last_percent == 0 then
+            redis.call('SET', keys[i], percent, 'EX', ttl)
+            redis.call('TS.ADD', keys[2], args[3], 1, 'RETENTION', DAY_MS, 'ON_DUPLICATE', 'LAST')
+            decisions[#decisions + 1] = {'new', signals, percent, ttl}
+        elseif math.abs(tonumber(percent)) > last_percent then
+            redis.call('SET', keys[i], percent, 'EX', ttl)
+            decisions[#decisions + 1] = {'update', signals, percent, ttl}
+        else
+            decisions[#decisions + 1] = {'nothing', signals, tostring(last_percent), ttl}
+        end
+    end
+    return decisions
+end
+
+redis.register_function('signal_decisions', signal_decisions)
+""".replace("DAY_MS", str(DAY_MS))
+
+
+class SignalStateCache:
+    """Worker-local LRU of the signal state keys (check ts and last percents) with their expiry.
+
+    A cached value settles a decision without calling Redis only when the function would answer "nothing":
+    last percents only grow while their key lives and a newer check ts only throttles longer, so a value
+    written meanwhile by another worker never makes a cached one wrong. Deleted keys would, the screener
+    announces them on INVALIDATION_CHANNEL.
+    """
+
+    def __init__(self, size: int = settings.SIGNAL_CACHE_SIZE) -> None:
+        self.size = size
+        self.entries: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self.hits = cache_lookups.labels("hit")
+        self.misses = cache_lookups.labels("miss")
+
+    def get(self, key: str, now: float) -> float | None:
+        if (entry := self.entries.get(key)) is None:
+            return None
+        if entry[1] <= now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, key: str, value: float, expires_at: float) -> None:
+        if not self.size:
+            return
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def settled(self, market_key: str, changes: list[PriceChange], now: float, check_timeout: float) -> bool:
+        if check_timeout and (check_ts := self.get(f"{market_key}_check_ts", now)) and check_ts > now - check_timeout:
+            self.hits.inc()
+            return True
+        for change in changes:
+            last_percent = self.get(f"{market_key}_{change.period}_last_percent", now)
+            if not last_percent or abs(change.percent) > last_percent:
+                self.misses.inc()
+                return False
+        self.hits.inc()
+        return True
+
+    def update(
+        self, market_key: str, changes: list[PriceChange], result: list, now: float, check_timeout: float
+    ) -> None:
+        if check_ts := result[0]:
+            self.set(f"{market_key}_check_ts", float(check_ts), now + check_timeout - TTL_MARGIN)
+        for change, (_, _, last_percent, ttl) in zip(changes, result[1:], strict=True):
+            if last_percent:
+                self.set(f"{market_key}_{change.period}_last_percent", float(last_percent), now + int(ttl) - TTL_MARGIN)
+
+    def invalidate(self, market_key: str) -> None:
+        prefix = f"{market_key}_"
+        for key in [key for key in self.entries if key.startswith(prefix)]:
+            del self.entries[key]
+
+    async def listen(self) -> None:
+        while True:
+            try:
+                async with redis.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    # invalidations sent while unsubscribed are lost, nothing cached before can be trusted
+                    self.entries.clear()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.invalidate(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                await logger.awarning(f"Signal cache invalidations lost: {err}", exc_info=True)
+            self.entries.clear()
+            await asyncio.sleep(1)
+
+
+signal_cache = SignalStateCache()
+
+
+async def load_functions() -> None:
+    await redis.function_load(LIBRARY, replace=True)
+
+
+def signal_ttl(period: int) -> int:
+    return int(period if period < (60 * 5) else period / 2)
+
+
+async def decide_signals(
+    changes: dict[str, list[PriceChange]], now: float, check_timeout: float = 0
+) -> list[tuple[str, PriceChange, str, int]]:
+    # markets the cache can answer for would only get "nothing" back
+    changes = {
+        market_key: market_changes
+        for market_key, market_changes in changes.items()
+        if not signal_cache.settled(market_key, market_changes, now, check_timeout)
+    }
+    if not changes:
+        return []
+
+    results = await call_decisions(changes, now, check_timeout)
+    if any(isinstance(result, ResponseError) and "function not found" in str(result).lower() for result in results):
+        # the library is gone after a FUNCTION FLUSH or a restart without persistence, so is the cached state
+        signal_cache.entries.clear()
+        await load_functions()
+        results = await call_decisions(changes, now, check_timeout)
+
+    decisions = []
+    for (market_key, market_changes), result in zip(changes.items(), results, strict=True):
+        if isinstance(result, Exception):
+            await logger.aerror(f"Failed to decide signals for {market_key}: {result}")
+            continue
+        signal_cache.update(market_key, market_changes, result, now, check_timeout)
+        for change, (decision, signals, *_) in zip(market_changes, result[1:], strict=True):
+            decisions.append((market_key, change, decision, int(signals)))
+    return decisions
+
+
+async def call_decisions(changes: dict[str, list[PriceChange]], now: float, check_timeout: float) -> list:
+    now_ms = int(now * 1000)
+    async with redis.pipeline(transaction=False) as pipe:
+        for market_key, market_changes in changes.items():
+            keys = [f"{market_key}_check_ts", f"{market_key}_signals"]
+            args = [now, check_timeout, now_ms, now_ms - DAY_MS]
+            for change in market_changes:
+                keys.append(f"{market_key}_{change.period}_last_percent")
+                args.extend((change.percent, signal_ttl(change.period)))
+            pipe.fcall("signal_decisions", len(keys), *keys, *args)
+        return await pipe.execute(raise_on_error=False)
@@ -0,0 +1,74 @@
+from bisect import bisect_left
+from operator import itemgetter
+from typing import NamedTuple
+
+from core.trend import is_uptrend_window, prefix_sums
+from settings import settings
+
+check_ranges = [
+    {"period": int(signal[0]) * 60, "threshold": float(signal[1])}
+    for signal in [d.split(",") for d in settings.SIGNAL_THRESHOLDS]
+]
+max_period = max([check_range["period"] for check_range in check_ranges])
+
+
+class PriceChange(NamedTuple):
+    period: int
+    percent: float
+    is_uptrend: bool
+    min_price: float
+    max_price: float
+
+
+def calc_percent(min_price: float, max_price: float) -> float:
+    return round(((max_price - min_price) / min_price) * 100, 1)
+
+
+def evaluate_prices(price_data: list, now: float, ticks: list[int] | None = None) -> list[PriceChange]:
+    """Price changes of a market over the SIGNAL_THRESHOLDS periods.
+
+    Compacted windows (see worker.merge_compacted) pass `ticks`, the running raw tick counts of their points:
+    a window is gated on the raw ticks it covers, min, max and the trend are taken from its points.
+    """
+    # points are sorted by time, every period is a suffix of the same price list
+    prices = [price[1] for price in price_data]
+    sums = None
+
+    changes = []
+    for check_range in check_ranges:
+        period = check_range["period"]
+        threshold = check_range["threshold"]
+
+        start_time = (int(now) - period) * 1000
+
+        start = bisect_left(price_data, start_time, key=itemgetter(0))
+        count = len(prices) - start
+        if (ticks[-1] - ticks[start] if ticks else count) < settings.PRICE_SUBSETS:
+            continue
+
+        window = prices[start:] if start else prices
+        min_price = min(window)
+        max_price = max(window)
+
+        if abs(price_change_percent := calc_percent(min_price, max_price)) > threshold:
+            # a compacted window may have fewer points than subsets, its trend is then from the first to the last
+            if count < settings.PRICE_SUBSETS:
+                is_uptrend = window[-1] > window[0]
+            else:
+                if sums is None:
+                    sums = prefix_sums(prices)
+                is_uptrend = is_uptrend_window(prices, sums, start, count)
+            changes.append(PriceChange(period, price_change_percent, is_uptrend, min_price, max_price))
+    return changes
+
+
+def evaluate_markets(
+    market_keys: list[str], price_data: list[list], now: float, ticks: list[list[int]] | None = None
+) -> dict[str, list[PriceChange]]:
+    # per market on the reply lists: packing them into arrays for core.vectorized costs more than it saves
+    # (see benchmarks/vectorized.py)
+    changes = {}
+    for i, (market_key, data) in enumerate(zip(market_keys, price_data, strict=True)):
+        if data and (market_changes := evaluate_prices(data, now, ticks[i] if ticks else None)):
+            changes[market_key] = market_changes
+    return changes
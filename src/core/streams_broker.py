@@ -0,0 +1,303 @@
+import asyncio
+import math
+import os
+import random
+import socket
+import time
+import zlib
+from collections import deque
+from contextlib import suppress
+from functools import partial
+from typing import Any, AsyncGenerator
+from uuid import uuid4
+
+import structlog
+from redis.asyncio import from_url
+from redis.exceptions import ResponseError
+from taskiq import AckableMessage, AsyncBroker, AsyncTaskiqDecoratedTask, BrokerMessage
+from taskiq.kicker import AsyncKicker
+
+from settings import settings
+
+logger = structlog.getLogger(__name__)
+
+GROUP = "workers"
+READ_BLOCK_MS = 1000
+BUSY_READ_BLOCK_MS = 50  # while buffered messages wait for a running task of their partition
+SHARED = -1  # stream of the tasks without a partition, read by every worker
+
+# leases are only touched by their owner, the value is the consumer name
+RENEW_LEASES = """
+local renewed = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        redis.call('PEXPIRE', key, ARGV[2])
+        renewed[i] = 1
+    else
+        renewed[i] = 0
+    end
+end
+return renewed
+"""
+RELEASE_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+PARTITIONS = settings.STREAM_PARTITIONS if settings.BROKER == "streams" else 1
+
+
+def market_partition(market_key: str) -> int:
+    return zlib.crc32(market_key.encode()) % PARTITIONS
+
+
+def partitioned(task: AsyncTaskiqDecoratedTask, partition: int) -> AsyncKicker:
+    return task.kicker().with_labels(partition=partition)
+
+
+class RedisStreamsBroker(AsyncBroker):
+    """Taskiq broker on Redis Streams, partitioned so that every market is handled by one consumer at a time.
+
+    Tasks go to one of `partitions` streams by their `partition` label. Every partition is leased to a single
+    worker process, workers balance the partitions between them through the leases, and within a worker a
+    partition has at most one task running. Reads are batched with XREADGROUP COUNT, acks are collected and
+    sent with one XACK per stream, entries left pending by a worker whose lease expired are taken over with
+    XAUTOCLAIM. A message not acked within `ack_timeout` frees its partition anyway. Tasks kicked without a
+    partition label (sending signals) go to a shared stream that every worker reads with no ordering, a worker
+    keeps the shared entries it runs from going idle so they are only claimed from a dead worker.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        partitions: int = settings.STREAM_PARTITIONS,
+        batch_size: int = settings.STREAM_BATCH_SIZE,
+        maxlen: int = settings.STREAM_MAXLEN,
+        lease_ms: int = settings.STREAM_LEASE_MS,
+        ack_timeout: float = settings.STREAM_ACK_TIMEOUT,
+        prefix: str = "taskiq:stream",
+    ) -> None:
+        super().__init__()
+        self.redis = from_url(url)
+        self.partitions = partitions
+        self.batch_size = batch_size
+        self.maxlen = maxlen
+        self.lease_ms = lease_ms
+        self.ack_timeout = ack_timeout
+        self.prefix = prefix
+        # leases are renewed between reads, a blocking read must not outlast a renewal period
+        self.block_ms = min(READ_BLOCK_MS, lease_ms // 3)
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+        self.renew_leases = self.redis.register_script(RENEW_LEASES)
+        self.release_lease = self.redis.register_script(RELEASE_LEASE)
+
+        self.owned: set[int] = set()
+        self.buffers: dict[int, deque[tuple[bytes, dict]]] = {p: deque() for p in (*range(partitions), SHARED)}
+        self.in_flight: dict[int, tuple[bytes, float]] = {}  # partition -> entry id, ack deadline
+        self.shared_in_flight: dict[bytes, float] = {}  # entry id -> ack deadline
+        self.acks: dict[int, list[bytes]] = {}
+        self.acked = asyncio.Event()
+        self.balanced_at = 0.0
+
+    def stream(self, partition: int) -> str:
+        return f"{self.prefix}:shared" if partition == SHARED else f"{self.prefix}:{partition}"
+
+    @staticmethod
+    def partition_of(stream: bytes) -> int:
+        name = stream.rsplit(b":", 1)[1]
+        return SHARED if name == b"shared" else int(name)
+
+    def lease(self, partition: int) -> str:
+        return f"{self.prefix}:lease:{partition}"
+
+    async def startup(self) -> None:
+        await super().startup()
+        if not self.is_worker_process:
+            return
+        for partition in (*range(self.partitions), SHARED):
+            try:
+                await self.redis.xgroup_create(self.stream(partition), GROUP, id="0", mkstream=True)
+            except ResponseError as err:
+                if "BUSYGROUP" not in str(err):
+                    raise
+
+    async def shutdown(self) -> None:
+        if self.is_worker_process:
+            await self.flush_acks()
+            for partition in list(self.owned):
+                await self.release(partition)
+            await self.redis.zrem(f"{self.prefix}:consumers", self.consumer)
+        await self.redis.aclose()
+        await super().shutdown()
+
+    async def kick(self, message: BrokerMessage) -> None:
+        partition = message.labels.get("partition")
+        stream = self.stream(SHARED if partition is None else int(partition) % self.partitions)
+        await self.redis.xadd(stream, {"data": message.message}, maxlen=self.maxlen, approximate=True)
+
+    async def listen(self) -> AsyncGenerator[AckableMessage, None]:
+        while True:
+            if time.monotonic() - self.balanced_at > self.lease_ms / 3000:
+                await self.balance()
+            await self.flush_acks()
+
+            if (message := self.next_message()) is not None:
+                yield message
+            else:
+                await self.read()
+
+    def next_message(self) -> AckableMessage | None:
+        if self.buffers[SHARED]:
+            entry_id, fields = self.buffers[SHARED].popleft()
+            self.shared_in_flight[entry_id] = time.monotonic() + self.ack_timeout
+            return AckableMessage(data=fields[b"data"], ack=partial(self.ack, SHARED, entry_id))
+
+        for partition in self.owned:
+            if self.buffers[partition] and not self.busy(partition):
+                entry_id, fields = self.buffers[partition].popleft()
+                self.in_flight[partition] = entry_id, time.monotonic() + self.ack_timeout
+                return AckableMessage(data=fields[b"data"], ack=partial(self.ack, partition, entry_id))
+        return None
+
+    def busy(self, partition: int) -> bool:
+        if (in_flight := self.in_flight.get(partition)) is None:
+            return False
+        entry_id, deadline = in_flight
+        if time.monotonic() < deadline:
+            return True
+        # the receiver returns without an ack for a message it can't parse, an unknown task (during a deploy)
+        # or a failed middleware; such an entry is acked here so its partition moves on
+        logger.warning(f"Task of partition {partition} not acked in {self.ack_timeout}s", entry_id=entry_id)
+        self.ack(partition, entry_id)
+        return False
+
+    def ack(self, partition: int, entry_id: bytes) -> None:
+        # a late ack of an expired entry must not free the partition from the entry that runs now
+        if self.in_flight.get(partition, (None,))[0] == entry_id:
+            del self.in_flight[partition]
+        elif partition == SHARED:
+            self.shared_in_flight.pop(entry_id, None)
+        self.acks.setdefault(partition, []).append(entry_id)
+        self.acked.set()
+
+    async def flush_acks(self) -> None:
+        if not self.acks:
+            return
+        acks, self.acks = self.acks, {}
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for partition, entry_ids in acks.items():
+                pipe.xack(self.stream(partition), GROUP, *entry_ids)
+            await pipe.execute()
+
+    async def read(self) -> None:
+        # partitions with buffered entries wait for their running task, there's nothing to read for them
+        streams = {self.stream(p): ">" for p in (*self.owned, SHARED) if not self.buffers[p]}
+        if not streams:
+            self.acked.clear()
+            with suppress(TimeoutError):
+                await asyncio.wait_for(self.acked.wait(), self.block_ms / 1000)
+            return
+
+        block = BUSY_READ_BLOCK_MS if len(streams) <= len(self.owned) else self.block_ms
+        replies = await self.redis.xreadgroup(GROUP, self.consumer, streams, count=self.batch_size, block=block)
+        for stream, entries in replies or []:
+            self.buffers[self.partition_of(stream)].extend(entries)
+
+    async def balance(self) -> None:
+        self.balanced_at = time.monotonic()
+        share = await self.fair_share()
+        await self.renew()
+        for partition in self.owned:
+            await self.claim(partition, self.lease_ms)
+        await self.touch_shared()
+        await self.claim(SHARED, self.lease_ms)
+
+        # hand over idle partitions above the fair share, busy ones are released on a later round
+        for partition in [p for p in self.owned if not self.busy(p) and not self.buffers[p]]:
+            if len(self.owned) <= share:
+                break
+            await self.release(partition)
+
+        free = [p for p in range(self.partitions) if p not in self.owned]
+        random.shuffle(free)
+        for partition in free:
+            if len(self.owned) >= share:
+                break
+            if await self.redis.set(self.lease(partition), self.consumer, nx=True, px=self.lease_ms):
+                self.owned.add(partition)
+                await self.claim(partition, self.lease_ms)
+
+    async def touch_shared(self) -> None:
+        """Keeps the running signal tasks of this worker from being claimed by another one.
+
+        A shared entry has no lease, its idle time is reset every round while it runs, so only the entries of a
+        dead worker get idle for a whole lease: a slow send (Telegram retries) is never sent twice. An entry not
+        acked in `ack_timeout` is acked here like a stuck partition entry.
+        """
+        now = time.monotonic()
+        for entry_id in [entry_id for entry_id, deadline in self.shared_in_flight.items() if deadline <= now]:
+            logger.warning(f"Shared task not acked in {self.ack_timeout}s", entry_id=entry_id)
+            self.ack(SHARED, entry_id)
+        if self.shared_in_flight:
+            await self.redis.xclaim(
+                self.stream(SHARED), GROUP, self.consumer, 0, list(self.shared_in_flight), justid=True
+            )
+
+    async def fair_share(self) -> int:
+        now_ms = int(time.time() * 1000)
+        consumers = f"{self.prefix}:consumers"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(consumers, {self.consumer: now_ms})
+            pipe.zremrangebyscore(consumers, 0, now_ms - self.lease_ms)
+            pipe.zcard(consumers)
+            *_, live = await pipe.execute()
+        return math.ceil(self.partitions / max(live, 1))
+
+    async def renew(self) -> None:
+        if not self.owned:
+            return
+        owned = sorted(self.owned)
+        renewed = await self.renew_leases(keys=[self.lease(p) for p in owned], args=[self.consumer, self.lease_ms])
+        for partition, ok in zip(owned, renewed, strict=True):
+            if not ok:
+                await logger.awarning(f"Lost the lease of partition {partition}", consumer=self.consumer)
+                self.drop(partition)
+
+    async def claim(self, partition: int, min_idle_ms: int) -> None:
+        """Takes over entries the previous owner read and didn't ack, they are processed first.
+
+        Only entries idle for a whole lease are taken, the previous owner may still be running younger ones
+        (it lost the lease on a slow round). Those are picked up by the claim of a later balance round.
+        """
+        held = {entry_id for entry_id, _ in self.buffers[partition]}
+        if in_flight := self.in_flight.get(partition):
+            held.add(in_flight[0])
+        if partition == SHARED:
+            held.update(self.shared_in_flight)
+
+        start_id: Any = "0-0"
+        while True:
+            start_id, entries, *_ = await self.redis.xautoclaim(
+                self.stream(partition),
+                GROUP,
+                self.consumer,
+                min_idle_time=min_idle_ms,
+                start_id=start_id,
+                count=self.batch_size,
+            )
+            # our own entries waiting in the buffer get idle as well, they must not be queued twice
+            self.buffers[partition].extend(entry for entry in entries if entry[0] not in held)
+            if start_id in (b"0-0", "0-0"):
+                return
+
+    async def release(self, partition: int) -> None:
+        self.drop(partition)
+        await self.release_lease(keys=[self.lease(partition)], args=[self.consumer])
+
+    def drop(self, partition: int) -> None:
+        # buffered entries stay pending in the group, the next owner claims them
+        self.owned.discard(partition)
+        self.buffers[partition].clear()
+        self.in_flight.pop(partition, None)
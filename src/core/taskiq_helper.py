@@ -13,6 +13,7 @@ from taskiq_redis import ListQueueBroker
 
 import logging
 from core.logging import setup_logging
+from core.streams_broker import RedisStreamsBroker
 from core.utils import utcnow
 from settings import settings
 
@@ -59,7 +60,9 @@ class LoggingMiddleware(TaskiqMiddleware):
 
 
 setup_logging()
-broker = ListQueueBroker(url=settings.REDIS_URI).with_middlewares(
+broker = (
+    RedisStreamsBroker(settings.REDIS_URI) if settings.BROKER == "streams" else ListQueueBroker(url=settings.REDIS_URI)
+).with_middlewares(
     LoggingMiddleware(),
     PrometheusMiddleware(server_addr="0.0.0.0", server_port=9000),
 )
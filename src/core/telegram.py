@@ -1,11 +1,26 @@
+import asyncio
+
 import emoji
 import structlog
-from aiohttp import ClientSession
+from aiohttp import ClientSession, TCPConnector
+from prometheus_client import Counter
 
+from core.redis import redis
 from settings import settings
 
 logger = structlog.getLogger(__name__)
 
+coalesced_edits = Counter("screener_telegram_coalesced_edits", "Message edits replaced by a newer text before sending")
+
+
+# emojize() parses the whole alias table on every call, the icons never change
+GRC = emoji.emojize(":black_circle:")  # ":green_circle:"
+DELIM = emoji.emojize(":minus:")
+SIGNAL_ICON = emoji.emojize(":counterclockwise_arrows_button:")
+UP_ICON = emoji.emojize(":red_triangle_pointed_up:")
+DOWN_ICON = emoji.emojize(":red_triangle_pointed_down:")
+ROBOT_ICON = emoji.emojize(":robot:")
+
 
 def create_tg_message(
     exchange: str,
@@ -17,10 +32,6 @@ def create_tg_message(
     price_max: float,
     signals: int = 0,
 ) -> str:
-    grc = emoji.emojize(":black_circle:")  # ":green_circle:"
-    delim = emoji.emojize(":minus:")
-    signal_icon = emoji.emojize(":counterclockwise_arrows_button:")
-
     price_min = f"{price_min:.9f}".rstrip("0")
     price_min = price_min if not price_min.endswith(".") else price_min + "0"
 
@@ -28,60 +39,162 @@ def create_tg_message(
     price_max = price_max if not price_max.endswith(".") else price_max + "0"
 
     if is_uptrend:
-        icon = emoji.emojize(":red_triangle_pointed_up:")
+        icon = UP_ICON
         action = "Pump: +"
         txt_prices = f"{price_min} - {price_max}"
     else:
-        icon = emoji.emojize(":red_triangle_pointed_down:")
+        icon = DOWN_ICON
         action = "Dump: -"
         txt_prices = f"{price_max} - {price_min}"
-    DEBUG = "" if not settings.DEBUG else f" {emoji.emojize(":robot:")}"
+    DEBUG = "" if not settings.DEBUG else f" {ROBOT_ICON}"
 
     return (
-        f"{grc} {exchange} {delim} {period}м {delim}"
+        f"{GRC} {exchange} {DELIM} {period}м {DELIM}"
         f"[{symbol}](https://www.coinglass.com/tv/{exchange.capitalize()}_{symbol}){DEBUG}\n"
-        f"{icon} {action}{str(abs(percent))}% ({txt_prices})\n{signal_icon} Signals 24h: {signals}"
+        f"{icon} {action}{str(abs(percent))}% ({txt_prices})\n{SIGNAL_ICON} Signals 24h: {signals}"
     )
 
 
-async def send_tg_message(chat_id: int, message: str) -> None:
-    async with ClientSession() as sess:
-        url = f"https://api.telegram.org/bot{settings.BOT_API_KEY}/sendMessage"
-        logger.debug(f"SEND TELEGRAM: {chat_id=}: {url=}, {message=}")
-
-        res = await sess.post(
-            url,
-            json={
-                "chat_id": chat_id,
-                "text": message,
-                "parse_mode": "Markdown",
-                "disable_web_page_preview": True,
-            },
-        )
-        if not res.status == 200:
-            text_error = await res.text()
-            logger.error(f"Failed to send message to Telegram: {res.status} error={text_error}")
-        resp = await res.json()
-        return resp.get("result", {}).get("message_id", None)
-
-
-async def update_tg_message(chat_id: int, message_id: int, message: str) -> None:
-    async with ClientSession() as sess:
-        url = f"https://api.telegram.org/bot{settings.BOT_API_KEY}/editMessageText"
-        logger.debug(f"SEND TELEGRAM: {chat_id=}: {url=}, {message=}")
-
-        res = await sess.post(
-            url,
-            json={
-                "chat_id": chat_id,
-                "message_id": message_id,
-                "text": message,
-                "parse_mode": "Markdown",
-                "disable_web_page_preview": True,
-            },
-        )
-        if not res.status == 200:
-            text_error = await res.text()
-            logger.error(f"Failed to send message to Telegram: {res.status} error={text_error}")
-        resp = await res.json()
-        return resp.get("result", {}).get("message_id", None)
+BUCKET_IDLE_MS = 60_000
+PENDING_EDIT_MS = 60_000  # a worker that dies while its edit waits for the limiter doesn't block later edits
+KEY_PREFIX = "telegram"
+
+# Token buckets shared by every worker process in Redis, hashes of tokens, update time and pause (ms of the
+# Redis clock). A token is taken from all KEYS or from none; returns 0 or the ms to wait before trying again.
+# ARGV: the rate (per second) of every bucket
+ACQUIRE_BUCKETS = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local wait, tokens = 0, {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i])
+    local state = redis.call('HMGET', key, 'tokens', 'updated', 'paused_until')
+    local capacity = math.max(rate, 1)
+    tokens[i] = math.min(capacity, (tonumber(state[1]) or capacity) + (now - (tonumber(state[2]) or now)) * rate / 1000)
+    local paused_until = tonumber(state[3]) or 0
+    if now < paused_until then
+        wait = math.max(wait, paused_until - now)
+    elseif tokens[i] < 1 then
+        wait = math.max(wait, math.ceil((1 - tokens[i]) * 1000 / rate))
+    end
+end
+for i, key in ipairs(KEYS) do
+    if wait == 0 then
+        tokens[i] = tokens[i] - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens[i]), 'updated', now)
+    -- an idle bucket is full again, only a pause outlives it
+    local paused_until = tonumber(redis.call('HGET', key, 'paused_until') or '0')
+    redis.call('PEXPIRE', key, math.max(paused_until - now, 0) + BUCKET_IDLE_MS)
+end
+return wait
+""".replace("BUCKET_IDLE_MS", str(BUCKET_IDLE_MS))
+# ARGV: the pause (ms) of all KEYS
+PAUSE_BUCKETS = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local paused_until = now + tonumber(ARGV[1])
+for _, key in ipairs(KEYS) do
+    if paused_until > tonumber(redis.call('HGET', key, 'paused_until') or '0') then
+        redis.call('HSET', key, 'paused_until', paused_until)
+    end
+    redis.call('PEXPIRE', key, paused_until - now + BUCKET_IDLE_MS)
+end
+return 0
+""".replace("BUCKET_IDLE_MS", str(BUCKET_IDLE_MS))
+
+
+class TelegramClient:
+    """Sends bot messages over one pooled session within Telegram's global and per-chat rate limits.
+
+    The limits and the coalescing of edits are kept in Redis, so they hold for all worker processes together.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = settings.TG_GLOBAL_RATE,
+        chat_rate: float = settings.TG_CHAT_RATE,
+        max_retries: int = settings.TG_MAX_RETRIES,
+    ) -> None:
+        self.url = f"https://api.telegram.org/bot{settings.BOT_API_KEY}"
+        self.session: ClientSession | None = None
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self.acquire_buckets = redis.register_script(ACQUIRE_BUCKETS)
+        self.pause_buckets = redis.register_script(PAUSE_BUCKETS)
+        # keeps the waiters of a chat in order, so a burst of alerts goes out in the order it was created
+        self.chat_locks: dict[int, asyncio.Lock] = {}
+
+    async def get_session(self) -> ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = ClientSession(connector=TCPConnector(limit=100, keepalive_timeout=60))
+        return self.session
+
+    async def close(self) -> None:
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    def bucket_keys(self, chat_id: int) -> list[str]:
+        return [f"{KEY_PREFIX}:bucket:global", f"{KEY_PREFIX}:bucket:{chat_id}"]
+
+    async def acquire(self, chat_id: int) -> None:
+        if (lock := self.chat_locks.get(chat_id)) is None:
+            lock = self.chat_locks[chat_id] = asyncio.Lock()
+        async with lock:
+            args = [self.global_rate, self.chat_rate]
+            while wait_ms := await self.acquire_buckets(keys=self.bucket_keys(chat_id), args=args):
+                await asyncio.sleep(wait_ms / 1000)
+
+    async def send_message(self, chat_id: int, message: str) -> int | None:
+        await self.acquire(chat_id)
+        return await self.post("sendMessage", {"chat_id": chat_id, "text": message})
+
+    async def edit_message(self, chat_id: int, message_id: int, message: str) -> int | None:
+        key = f"{KEY_PREFIX}:edit:{chat_id}:{message_id}"
+        if await redis.set(key, message, px=PENDING_EDIT_MS, get=True) is not None:
+            # an edit of this message is already waiting for the limiter (in any worker), it sends the latest text
+            coalesced_edits.inc()
+            return message_id
+
+        try:
+            await self.acquire(chat_id)
+        finally:
+            message = await redis.getdel(key) or message
+        return await self.post("editMessageText", {"chat_id": chat_id, "message_id": message_id, "text": message})
+
+    async def post(self, method: str, payload: dict) -> int | None:
+        payload |= {"parse_mode": "Markdown", "disable_web_page_preview": True}
+        logger.debug(f"SEND TELEGRAM: {method=}, {payload=}")
+
+        session = await self.get_session()
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await self.acquire(payload["chat_id"])
+
+            async with session.post(f"{self.url}/{method}", json=payload) as res:
+                if res.status not in (200, 429):
+                    text_error = await res.text()
+                    await logger.aerror(f"Failed to send message to Telegram: {res.status} error={text_error}")
+                    return None
+                resp = await res.json()
+
+            if res.status == 200:
+                return resp.get("result", {}).get("message_id", None)
+
+            retry_after = resp.get("parameters", {}).get("retry_after", 1)
+            # a 429 may be for the whole bot, every chat waits it out
+            await self.pause_buckets(keys=self.bucket_keys(payload["chat_id"]), args=[int(retry_after * 1000)])
+            await logger.awarning(f"Telegram rate limit for chat {payload['chat_id']}, retry after {retry_after}s")
+        return None
+
+
+telegram = TelegramClient()
+
+
+async def send_tg_message(chat_id: int, message: str) -> int | None:
+    return await telegram.send_message(chat_id, message)
+
+
+async def update_tg_message(chat_id: int, message_id: int, message: str) -> int | None:
+    return await telegram.edit_message(chat_id, message_id, message)
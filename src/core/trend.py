@@ -0,0 +1,62 @@
+from itertools import accumulate
+
+from settings import settings
+
+# Subset means closer than this (relative) are re-checked by is_uptrend_prices(): a difference of prefix sums
+# rounds differently than the builtin sum() of the subset.
+TREND_TOLERANCE = 1e-9
+# rounding error of a prefix sum, relative to the running total it was taken from
+PREFIX_EPSILON = 1e-12
+
+
+def is_uptrend_prices(prices: list[float]) -> bool:
+    num_subsets = settings.PRICE_SUBSETS
+    subset_size = len(prices) // num_subsets
+
+    subset_means = []
+    for i in range(num_subsets):
+        subset = prices[i * subset_size : (i + 1) * subset_size]
+        subset_mean = sum(subset) / len(subset)
+        subset_means.append(subset_mean)
+
+    increasing_count, decreasing_count = 0, 0
+
+    for i in range(1, len(subset_means)):
+        if subset_means[i] > subset_means[i - 1]:
+            increasing_count += 1
+        elif subset_means[i] < subset_means[i - 1]:
+            decreasing_count += 1
+
+    return True if increasing_count > decreasing_count else False
+
+
+def prefix_sums(prices: list[float]) -> list[float]:
+    return list(accumulate(prices, initial=0.0))
+
+
+def is_uptrend_window(prices: list[float], sums: list[float], start: int, count: int) -> bool:
+    """is_uptrend_prices(prices[start:start + count]) from prefix sums of the prices.
+
+    `sums[j]` is the sum of `prices[:j]`, so every subset sum is a difference of two prefix sums: the verdict
+    takes PRICE_SUBSETS steps whatever the window length and copies nothing. Windows with two subset means
+    too close to call from the prefix sums fall back to the exact computation.
+    """
+    num_subsets = settings.PRICE_SUBSETS
+    size = count // num_subsets
+    # an error of the prefix sums grows with the running total, not with the subset
+    slack = PREFIX_EPSILON * abs(sums[start + num_subsets * size]) / size
+
+    increasing_count, decreasing_count = 0, 0
+    previous = None
+    for bound in range(start + size, start + (num_subsets + 1) * size, size):
+        mean = (sums[bound] - sums[bound - size]) / size
+        if previous is not None:
+            if abs(mean - previous) <= slack + TREND_TOLERANCE * abs(previous):
+                return is_uptrend_prices(prices[start : start + count])
+            if mean > previous:
+                increasing_count += 1
+            else:
+                decreasing_count += 1
+        previous = mean
+
+    return increasing_count > decreasing_count
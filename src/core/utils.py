@@ -1,5 +1,5 @@
 from datetime import datetime, timezone
-from typing import Any
+from typing import Any, Callable
 
 from msgspec import json
 
@@ -9,5 +9,5 @@ def utcnow() -> datetime:
     return datetime.utcnow().replace(tzinfo=timezone.utc)
 
 
-def dumps(obj: Any, **kwargs: dict[str, Any]) -> str:
-    return json.decode("utf-8")
+def dumps(obj: Any, default: Callable[[Any], Any] | None = None, **kwargs: Any) -> str:
+    return json.encode(obj, enc_hook=default).decode()
@@ -0,0 +1,117 @@
+from itertools import chain
+
+import numpy as np
+
+from core.signals import PriceChange, calc_percent, check_ranges
+from core.trend import is_uptrend_prices
+from settings import settings
+
+# Subset means closer than this are re-checked with the scalar code: numpy sums in a different order than
+# the builtin sum(), so only clearly separated means may be compared in vectorized form.
+TREND_TOLERANCE = 1e-9
+# round(percent, 1) can lift a value up to 0.05 above the raw percent
+ROUNDING_MARGIN = 0.05 + 1e-9
+
+
+class PriceWindows:
+    """Price windows of many markets as ragged arrays.
+
+    Points of market ``i`` are ``timestamps[offsets[i]:offsets[i + 1]]`` and ``prices[...]``, sorted by time,
+    like a TS.RANGE reply.
+    """
+
+    def __init__(self, market_keys: list[str], points: list[list]) -> None:
+        self.market_keys = [market_key for market_key, data in zip(market_keys, points, strict=True) if data]
+        lengths = [len(data) for data in points if data]
+        self.offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+
+        # fromiter over a flat chain is several times faster than np.array() on the nested reply lists
+        values = chain.from_iterable(chain.from_iterable(points))
+        flat = np.fromiter(values, dtype=np.float64, count=2 * int(self.offsets[-1])).reshape(-1, 2)
+        self.timestamps, self.prices = flat[:, 0], flat[:, 1]
+
+    def __len__(self) -> int:
+        return len(self.market_keys)
+
+
+def evaluate_windows(windows: PriceWindows, now: float) -> dict[str, list[PriceChange]]:
+    changes: dict[str, list[PriceChange]] = {}
+    if not len(windows):
+        return changes
+
+    starts, ends = windows.offsets[:-1], windows.offsets[1:]
+    for check_range in check_ranges:
+        period, threshold = check_range["period"], check_range["threshold"]
+        in_window = windows.timestamps >= (int(now) - period) * 1000
+
+        counts = np.add.reduceat(in_window, starts, dtype=np.int64)
+        min_prices = np.minimum.reduceat(np.where(in_window, windows.prices, np.inf), starts)
+        max_prices = np.maximum.reduceat(np.where(in_window, windows.prices, -np.inf), starts)
+
+        valid = (counts >= settings.PRICE_SUBSETS) & (min_prices > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percents = (max_prices - min_prices) / min_prices * 100
+        candidates = np.flatnonzero(valid & (np.abs(percents) > threshold - ROUNDING_MARGIN))
+
+        # the exact rounding and the threshold comparison are done in python for the few candidates left
+        crossed = []
+        for index in candidates:
+            percent = calc_percent(float(min_prices[index]), float(max_prices[index]))
+            if abs(percent) > threshold:
+                crossed.append((index, percent))
+        if not crossed:
+            continue
+
+        indexes = np.array([index for index, _ in crossed])
+        uptrends = uptrend_prices(windows.prices, ends[indexes] - counts[indexes], counts[indexes])
+        for (index, percent), is_uptrend in zip(crossed, uptrends, strict=True):
+            change = PriceChange(period, percent, is_uptrend, float(min_prices[index]), float(max_prices[index]))
+            changes.setdefault(windows.market_keys[index], []).append(change)
+    return changes
+
+
+def uptrend_prices(prices: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> list[bool]:
+    num_subsets = settings.PRICE_SUBSETS
+    subset_sizes = counts // num_subsets
+
+    # the closing bound of the last market may point right past the end of prices
+    bounds = starts[:, None] + subset_sizes[:, None] * np.arange(num_subsets + 1)
+    sums = np.add.reduceat(np.append(prices, 0.0), bounds.ravel()).reshape(-1, num_subsets + 1)[:, :num_subsets]
+    means = sums / subset_sizes[:, None]
+
+    current, previous = means[:, 1:], means[:, :-1]
+    increasing = (current > previous).sum(axis=1)
+    decreasing = (current < previous).sum(axis=1)
+    ambiguous = (np.abs(current - previous) <= TREND_TOLERANCE * np.abs(previous)).any(axis=1)
+
+    uptrends = (increasing > decreasing).tolist()
+    for index in np.flatnonzero(ambiguous):
+        start, count = starts[index], counts[index]
+        uptrends[index] = is_uptrend_prices(prices[start : start + count].tolist())
+    return uptrends
+
+
+def bucket_candidates(lows: PriceWindows, highs: PriceWindows, now: float, bucket_ms: int) -> list[str]:
+    """Markets that may cross a threshold judging by min and max aggregation buckets of the same series.
+
+    A bucket counts towards a window if any of its points could be inside it, so the estimated change is never
+    below the exact one and no signalling market is missed.
+    """
+    if not len(lows):
+        return []
+
+    starts = lows.offsets[:-1]
+    bucket_ends = lows.timestamps + (bucket_ms - 1)
+    candidates = np.zeros(len(lows), dtype=bool)
+    for check_range in check_ranges:
+        in_window = bucket_ends >= (int(now) - check_range["period"]) * 1000
+
+        min_prices = np.minimum.reduceat(np.where(in_window, lows.prices, np.inf), starts)
+        max_prices = np.maximum.reduceat(np.where(in_window, highs.prices, -np.inf), starts)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percents = (max_prices - min_prices) / min_prices * 100
+        candidates |= (
+            (min_prices > 0) & np.isfinite(max_prices) & (percents > check_range["threshold"] - ROUNDING_MARGIN)
+        )
+    return [lows.market_keys[index] for index in np.flatnonzero(candidates)]
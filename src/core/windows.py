@@ -0,0 +1,139 @@
+from collections import deque
+
+from core.signals import PriceChange, calc_percent, check_ranges
+from core.trend import is_uptrend_window, prefix_sums
+from settings import settings
+
+COMPACT_THRESHOLD = 1024
+
+
+class MarketWindow:
+    """Ring buffer of accepted ticks with monotonic min/max deques per signal period.
+
+    Every tick gets a sequence number, so a period window is just ``[starts[i], next_seq)``
+    and min/max deques drop entries by sequence instead of by value. Prefix sums of the prices
+    give the trend of any window without summing it again.
+    """
+
+    __slots__ = ("periods", "timestamps", "prices", "sums", "base_seq", "next_seq", "starts", "mins", "maxs")
+
+    def __init__(self, periods: list[int]) -> None:
+        self.periods = periods
+        self.timestamps: list[int] = []
+        self.prices: list[float] = []
+        self.sums = [0.0]
+        self.base_seq = 0
+        self.next_seq = 0
+        self.starts = [0] * len(periods)
+        self.mins: list[deque[tuple[int, float]]] = [deque() for _ in periods]
+        self.maxs: list[deque[tuple[int, float]]] = [deque() for _ in periods]
+
+    def add(self, timestamp: int, price: float) -> None:
+        # exchanges may deliver slightly out of order trades, keep the buffer sorted by time
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            timestamp = self.timestamps[-1]
+
+        seq = self.next_seq
+        self.timestamps.append(timestamp)
+        self.prices.append(price)
+        self.sums.append(self.sums[-1] + price)
+        self.next_seq += 1
+
+        for mins, maxs in zip(self.mins, self.maxs, strict=True):
+            while mins and mins[-1][1] >= price:
+                mins.pop()
+            mins.append((seq, price))
+            while maxs and maxs[-1][1] <= price:
+                maxs.pop()
+            maxs.append((seq, price))
+
+    def expire(self, now_ms: int) -> None:
+        timestamps, base_seq, next_seq = self.timestamps, self.base_seq, self.next_seq
+        for i, period in enumerate(self.periods):
+            cutoff, start = now_ms - period, self.starts[i]
+            while start < next_seq and timestamps[start - base_seq] < cutoff:
+                start += 1
+            self.starts[i] = start
+
+            mins, maxs = self.mins[i], self.maxs[i]
+            while mins and mins[0][0] < start:
+                mins.popleft()
+            while maxs and maxs[0][0] < start:
+                maxs.popleft()
+
+        if (head := min(self.starts) - base_seq) > COMPACT_THRESHOLD and head * 2 > len(timestamps):
+            del self.timestamps[:head]
+            del self.prices[:head]
+            # summed again from the new head, which also drops the rounding error of the expired ticks
+            self.sums = prefix_sums(self.prices)
+            self.base_seq += head
+
+    def count(self, index: int) -> int:
+        return self.next_seq - self.starts[index]
+
+    def min_price(self, index: int) -> float:
+        return self.mins[index][0][1]
+
+    def max_price(self, index: int) -> float:
+        return self.maxs[index][0][1]
+
+    def is_uptrend(self, index: int) -> bool:
+        return is_uptrend_window(self.prices, self.sums, self.starts[index] - self.base_seq, self.count(index))
+
+
+class RollingWindows:
+    def __init__(self) -> None:
+        self.periods = [check_range["period"] for check_range in check_ranges]
+        self.thresholds = [check_range["threshold"] for check_range in check_ranges]
+        self.periods_ms = [period * 1000 for period in self.periods]
+        self.windows: dict[str, MarketWindow] = {}
+        # windows of markets first seen since the start, their history is still in Redis only
+        self.cold: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.windows)
+
+    def add(self, market_key: str, timestamp: int, price: float) -> None:
+        if not (window := self.windows.get(market_key)):
+            window = self.windows[market_key] = MarketWindow(self.periods_ms)
+            self.cold.add(market_key)
+        window.add(timestamp, price)
+
+    def warm(self, market_key: str, history: list) -> None:
+        """Puts the points read from Redis in front of the ticks the window got since the market was seen."""
+        self.cold.discard(market_key)
+        if not (window := self.windows.get(market_key)):
+            return
+        # a cold window is never evaluated, so it still holds every tick it got
+        first_live = window.timestamps[0] if window.timestamps else None
+
+        warmed = MarketWindow(self.periods_ms)
+        for timestamp, price in history:
+            if first_live is None or timestamp < first_live:
+                warmed.add(int(timestamp), float(price))
+        for timestamp, price in zip(window.timestamps, window.prices, strict=True):
+            warmed.add(timestamp, price)
+        self.windows[market_key] = warmed
+
+    def remove(self, market_key: str) -> None:
+        self.windows.pop(market_key, None)
+        self.cold.discard(market_key)
+
+    def evaluate(self, market_key: str, now: float) -> list[PriceChange]:
+        # a cold window only knows the time since the start, its long periods would miss their signals
+        if market_key in self.cold or not (window := self.windows.get(market_key)):
+            return []
+
+        # same window boundaries as the worker uses for TS.RANGE
+        window.expire(int(now) * 1000)
+
+        changes = []
+        for i, threshold in enumerate(self.thresholds):
+            if window.count(i) < settings.PRICE_SUBSETS:
+                continue
+
+            min_price, max_price = window.min_price(i), window.max_price(i)
+            if abs(percent := calc_percent(min_price, max_price)) > threshold:
+                is_uptrend = window.is_uptrend(i)
+                changes.append(PriceChange(self.periods[i], percent, is_uptrend, min_price, max_price))
+        return changes
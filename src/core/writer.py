@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+import structlog
+
+from core.metrics import redis_write_seconds
+from core.provisioning import provision_markets
+from core.redis import redis
+from settings import settings
+
+logger = structlog.getLogger(__name__)
+
+MAX_INFLIGHT_FLUSHES = 4
+
+
+class TimeSeriesWriter:
+    def __init__(
+        self,
+        flush_interval: float = settings.WRITE_FLUSH_INTERVAL,
+        batch_size: int = settings.WRITE_BATCH_SIZE,
+        capacity: int = settings.WRITE_BUFFER_CAPACITY,
+    ) -> None:
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.capacity = capacity
+        self.buffer: list[tuple[str, int, float]] = []
+        self.flushes: set[asyncio.Task] = set()
+        self.written_count = 0
+        self.failed_count = 0
+        self.dropped_count = 0
+
+    def add(self, market_key: str, timestamp: int, price: float) -> None:
+        # while every flush slot is busy the buffer is capped like the bus, prices that don't fit are counted
+        if len(self.buffer) >= self.capacity:
+            self.dropped_count += 1
+            return
+        self.buffer.append((market_key, timestamp, price))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        # a slow flush keeps running in the background, new ticks accumulate until a slot is free
+        if not self.buffer or len(self.flushes) >= MAX_INFLIGHT_FLUSHES:
+            return
+
+        batch, self.buffer = self.buffer, []
+        task = asyncio.create_task(self.write(batch))
+        self.flushes.add(task)
+        task.add_done_callback(self.flushes.discard)
+
+    async def write(self, batch: list[tuple[str, int, float]], retry: bool = True) -> None:
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for i in range(0, len(batch), self.batch_size):
+                    pipe.ts().madd(batch[i : i + self.batch_size])
+                start = time.perf_counter()
+                results = await pipe.execute(raise_on_error=False)
+                redis_write_seconds.observe(time.perf_counter() - start)
+        except Exception as err:
+            self.failed_count += len(batch)
+            await logger.aerror(f"Failed to write {len(batch)} prices to Redis: {err}", exc_info=True)
+            return
+
+        failed = self.failed_samples(batch, results)
+        self.written_count += len(batch) - len(failed)
+        # markets evicted by the sweeper or first seen in a replay have no series yet, they are created and
+        # their prices written once more
+        missing = [sample for sample, error in failed if retry and "does not exist" in str(error)]
+        if errors := [(sample, error) for sample, error in failed if not retry or "does not exist" not in str(error)]:
+            self.failed_count += len(errors)
+            await logger.aerror(f"Failed to write {len(errors)} of {len(batch)} prices to Redis: {errors[0][1]}")
+        if missing:
+            await self.reprovision(missing)
+
+    async def reprovision(self, samples: list[tuple[str, int, float]]) -> None:
+        markets = sorted({sample[0] for sample in samples})
+        await logger.awarning(f"Series of {len(markets)} markets missing, provisioning and writing again")
+        try:
+            await provision_markets([tuple(market_key.split("_", 1)) for market_key in markets])  # type: ignore
+        except Exception as err:
+            self.failed_count += len(samples)
+            await logger.aerror(f"Failed to provision series of {len(markets)} markets: {err}")
+            return
+        await self.write(samples, retry=False)
+
+    def failed_samples(
+        self, batch: list[tuple[str, int, float]], results: list
+    ) -> list[tuple[tuple[str, int, float], Exception]]:
+        failed = []
+        for i, chunk in enumerate(results):
+            samples = batch[i * self.batch_size : (i + 1) * self.batch_size]
+            # TS.MADD replies per sample, a failed command as a whole fails all of its samples
+            replies = chunk if isinstance(chunk, list) else [chunk] * len(samples)
+            failed.extend(
+                (sample, reply) for sample, reply in zip(samples, replies, strict=True) if isinstance(reply, Exception)
+            )
+        return failed
+
+    async def run(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                self.flush()
+        finally:
+            if self.buffer:
+                batch, self.buffer = self.buffer, []
+                await self.write(batch)
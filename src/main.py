@@ -4,9 +4,17 @@ import signal
 import structlog
 import uvloop
 
-from adapters import adapters_list
+from adapters import adapters, adapters_list
+from adapters.catalog import catalog
+from adapters.recorder import recorder
+from adapters.replay import FrameReplay
+from adapters.session import shared_session
+from adapters.supervisor import AdapterSupervisor, ProcessSupervisor, exchange_groups, pin_to_core, watch_parent
+from core.bus import TradeBus
 from core.logging import setup_logging
+from core.metrics import start_metrics_server
 from core.screener import Screener
+from core.sharding import ShardRouter
 from settings import settings
 
 setup_logging()
@@ -17,20 +25,64 @@ def close_tasks(tasks: list) -> None:
         task.cancel()
 
 
-async def main() -> None:
+async def main(exchanges: list[str], metrics_port: int = settings.METRICS_PORT, child: bool = False) -> None:
     structlog.contextvars.bind_contextvars(version=settings.VERSION, environment=settings.ENVIRONMENT)
 
-    trades_queue: asyncio.Queue = asyncio.Queue()
-    screener = Screener()
+    trades_bus = TradeBus()
 
-    tasks = [
-        asyncio.create_task(screener.process_trades(trades_queue)),
-        asyncio.create_task(screener.state_watcher(trades_queue)),
-    ]
+    if settings.SCREENER_SHARDS > 1:
+        # adapters only receive and decode here, screening runs in the shard processes
+        router = ShardRouter(settings.SCREENER_SHARDS)
+        router.register_metrics(trades_bus)
+        tasks = [
+            asyncio.create_task(router.run(trades_bus)),
+            asyncio.create_task(router.state_watcher(trades_bus)),
+        ]
+    else:
+        screener = Screener()
+        screener.register_metrics(trades_bus)
+        tasks = [
+            asyncio.create_task(screener.process_trades(trades_bus)),
+            asyncio.create_task(screener.writer.run()),
+            asyncio.create_task(screener.dispatcher.run()),
+            asyncio.create_task(screener.state_watcher(trades_bus)),
+        ]
+        if settings.MARKET_IDLE_TIMEOUT:
+            tasks.append(asyncio.create_task(screener.sweeper()))
 
-    for exchange in settings.EXCHANGES:
-        if exchange in adapters_list:
-            tasks.append(asyncio.create_task(adapters_list[exchange](trades_queue)))
+    if settings.REPLAY_PATH:
+        # recorded frames stand in for the websockets, everything after the adapters runs as usual
+        replay_adapters = {exchange: adapters[exchange] for exchange in exchanges if exchange in adapters}
+        tasks.append(asyncio.create_task(FrameReplay().run(replay_adapters or adapters, trades_bus)))
+    else:
+        # adapters of all the exchanges share this loop, the Redis pool and the HTTP session
+        supervisor = AdapterSupervisor([exchange for exchange in exchanges if exchange in adapters_list])
+        tasks.append(asyncio.create_task(supervisor.run(trades_bus)))
+        tasks.append(asyncio.create_task(supervisor.usage_watcher()))
+        if recorder:
+            recorder.register_metrics()
+            tasks.append(asyncio.create_task(recorder.run()))
+
+    if child:
+        tasks.append(asyncio.create_task(watch_parent()))
+
+    start_metrics_server(metrics_port)
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(sig, lambda: close_tasks(tasks))
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await catalog.close()
+    await shared_session.close()
+
+
+async def supervise_processes(groups: list[list[str]]) -> None:
+    structlog.contextvars.bind_contextvars(version=settings.VERSION, environment=settings.ENVIRONMENT)
+    processes = ProcessSupervisor(groups, run_group)
+    processes.register_metrics()
+    tasks = [asyncio.create_task(processes.run()), asyncio.create_task(processes.usage_watcher())]
+
+    start_metrics_server()
 
     for sig in (signal.SIGTERM, signal.SIGINT):
         asyncio.get_running_loop().add_signal_handler(sig, lambda: close_tasks(tasks))
@@ -38,6 +90,19 @@ async def main() -> None:
     await asyncio.gather(*tasks, return_exceptions=True)
 
 
+def run_group(index: int, exchanges: list[str]) -> None:
+    # a child is a whole screener for its share of the exchanges, on its own core and metrics port
+    if settings.PIN_EXCHANGE_PROCESSES:
+        pin_to_core(index)
+    settings.EXCHANGES = exchanges
+    metrics_port = settings.METRICS_PORT and settings.METRICS_PORT + index + 1
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        runner.run(main(exchanges, metrics_port, child=True))
+
+
 if __name__ == "__main__":
     with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
-        runner.run(main())
+        if settings.EXCHANGE_PROCESSES and not settings.REPLAY_PATH:
+            runner.run(supervise_processes(exchange_groups(settings.EXCHANGES, settings.EXCHANGE_PROCESSES)))
+        else:
+            runner.run(main(settings.EXCHANGES))
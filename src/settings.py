@@ -11,12 +11,53 @@ class Settings(BaseSettings):
     COLORED_LOGS: bool = not JSON_LOGS
     SAVE_LOG_FILE: bool = False
     LOG_FILE_PATH: str = "logs/test_bot.log"
+    LOG_QUEUE: bool = True
+    LOG_SAMPLE_RATE: int = 100
 
     REDIS_URI: str = "redis://screener_redis:6379"
 
     CLEAR_INTERVAL: int = 60
+    MARKET_IDLE_TIMEOUT: int = 60 * 60 * 24
     PRICE_SUBSETS: int = 5
     SIGNAL_TIMEOUT: int = 60 * 2
+    LOCAL_WINDOWS: bool = True
+    CHECK_INTERVAL: float = 2.0
+    CHECK_BATCH_SIZE: int = 100
+    MRANGE_CHECKS: bool = False
+    MRANGE_BUCKET_MS: int = 0
+    COMPACTION_BUCKET_MS: int = 0
+    COMPACTION_RAW_RETENTION: int = 10
+    WRITE_FLUSH_INTERVAL: float = 0.05
+    WRITE_BATCH_SIZE: int = 1000
+    WRITE_BUFFER_CAPACITY: int = 200_000
+    BUS_CAPACITY: int = 200_000
+    BUS_HIGH_WATERMARK: int = 100_000
+    BUS_LOW_WATERMARK: int = 20_000
+    SCREENER_SHARDS: int = 1
+    SHARD_QUEUE_SIZE: int = 10_000
+    SIGNAL_CACHE_SIZE: int = 10000
+    BROKER: str = "list"
+    STREAM_PARTITIONS: int = 16
+    STREAM_BATCH_SIZE: int = 100
+    STREAM_MAXLEN: int = 100_000
+    STREAM_LEASE_MS: int = 10_000
+    STREAM_ACK_TIMEOUT: float = 60.0
+    TG_GLOBAL_RATE: float = 30.0
+    TG_CHAT_RATE: float = 1.0
+    TG_MAX_RETRIES: int = 3
+    SYMBOLS_CACHE_DIR: str = ".cache/symbols"
+    SYMBOLS_CACHE_TTL: int = 60 * 60
+    MAX_STREAMS: dict[str, int] = {}
+    DECOMPRESS_OFFLOAD_BYTES: int = 64 * 1024
+    DECOMPRESS_QUEUE_SIZE: int = 1000
+    DECOMPRESS_THREADS: int = 2
+    RECORD_DIR: str = ""
+    RECORD_SEGMENT_SECONDS: int = 60 * 10
+    RECORD_BUFFER_CAPACITY: int = 100_000
+    REPLAY_PATH: str = ""
+    REPLAY_SPEED: float = 1.0
+    METRICS_PORT: int = 9100
+    METRICS_SAMPLE_RATE: int = 64
 
     BOT_API_KEY: str
 
@@ -24,6 +65,9 @@ class Settings(BaseSettings):
     SIGNAL_THRESHOLDS: list[str]
 
     EXCHANGES: list[str] = []
+    EXCHANGE_PROCESSES: int = 0
+    PIN_EXCHANGE_PROCESSES: bool = True
+    ADAPTER_RESTART_DELAY: float = 5.0
 
 
 settings = Settings()
@@ -1,108 +1,218 @@
+import asyncio
 import time
+from itertools import chain, groupby
+from operator import itemgetter
 
 import structlog
+from taskiq import TaskiqState
+from taskiq.events import TaskiqEvents
 
-from core.redis import redis, time_series
+from core.redis import COMPACTIONS, PRICE_COMPACTIONS, redis, time_series
+from core.signal_state import decide_signals, load_functions, signal_cache
+from core.signals import PriceChange, evaluate_markets, evaluate_prices, max_period
 from core.taskiq_helper import broker
-from core.telegram import create_tg_message, send_tg_message, update_tg_message
+from core.telegram import create_tg_message, send_tg_message, telegram, update_tg_message
+from core.vectorized import PriceWindows, bucket_candidates
 from settings import settings
 
 logger = structlog.get_logger(__name__)
-check_ranges = [
-    {"period": int(signal[0]) * 60, "threshold": float(signal[1])}
-    for signal in [d.split(",") for d in settings.SIGNAL_THRESHOLDS]
-]
 
 
-def is_uptrend_prices(prices: list[float]) -> bool:
-    num_subsets = settings.PRICE_SUBSETS
-    subset_size = len(prices) // num_subsets
+@broker.on_event(TaskiqEvents.WORKER_STARTUP)
+async def startup(state: TaskiqState) -> None:
+    await load_functions()
+    state.signal_cache_listener = asyncio.create_task(signal_cache.listen())
 
-    subset_means = []
-    for i in range(num_subsets):
-        subset = prices[i * subset_size : (i + 1) * subset_size]
-        subset_mean = sum(subset) / len(subset)
-        subset_means.append(subset_mean)
 
-    increasing_count, decreasing_count = 0, 0
-
-    for i in range(1, len(subset_means)):
-        if subset_means[i] > subset_means[i - 1]:
-            increasing_count += 1
-        elif subset_means[i] < subset_means[i - 1]:
-            decreasing_count += 1
-
-    return True if increasing_count > decreasing_count else False
+@broker.on_event(TaskiqEvents.WORKER_SHUTDOWN)
+async def shutdown(state: TaskiqState) -> None:
+    if listener := getattr(state, "signal_cache_listener", None):
+        listener.cancel()
+    await telegram.close()
 
 
 @broker.task
 async def check_price_change(market_key: str, check_timeout: float = 2.0) -> None:
-    if not await redis.exists(market_key):
+    now = time.time()
+    start_time, now_ms = (int(now) - max_period) * 1000, int(now * 1000)
+
+    price_data, ticks = await fetch_ranges([market_key], start_time, now_ms)
+    if not price_data[0]:
         return
 
-    check_key = f"{market_key}_check_ts"
-    if check_ts := await redis.get(check_key):
-        if float(check_ts) > time.time() - check_timeout:
-            return
+    try:
+        changes = evaluate_prices(price_data[0], now, ticks[0] if ticks else None)
+    except Exception as err:
+        await logger.aerror(f"Failed to check price change for {market_key}: {err}", exc_info=True)
+        return
 
-    await redis.set(check_key, time.time())
+    if changes:
+        await process_price_changes({market_key: changes}, now, check_timeout)
 
-    max_period = max([check_range["period"] for check_range in check_ranges])
-    start_time = (int(time.time()) - max_period) * 1000
-    now_ms = int(time.time() * 1000)
 
-    if not (price_data := await time_series.range(market_key, start_time, now_ms)):
-        return
+@broker.task
+async def check_price_changes(market_keys: list[str]) -> None:
+    now = time.time()
+    start_time, now_ms = (int(now) - max_period) * 1000, int(now * 1000)
 
-    for check_range in check_ranges:
-        period = check_range["period"]
-        threshold = check_range["threshold"]
+    price_data, ticks = await fetch_ranges(market_keys, start_time, now_ms)
+    await process_price_changes(evaluate_markets(market_keys, price_data, now, ticks), now)
 
-        start_time = (int(time.time()) - period) * 1000
-        before_24h = int((time.time() - 60 * 60 * 24) * 1000)
 
-        prices = [price[1] for price in price_data if price[0] >= start_time]
-        if len(prices) < settings.PRICE_SUBSETS:
-            continue
+@broker.task
+async def check_exchange(exchange: str, symbols: list[str] | None = None) -> None:
+    now = time.time()
+    start_time, now_ms = (int(now) - max_period) * 1000, int(now * 1000)
 
-        min_price = min(prices)
-        max_price = max(prices)
+    filters = [f"exchange={exchange}"]
+    if symbols:
+        filters.append(f"symbol=({','.join(symbols)})")
 
-        try:
-            price_change_percent = round(((max_price - min_price) / min_price) * 100, 1)
-            is_uptrend = is_uptrend_prices(prices)
-        except Exception as err:
-            await logger.aerror(f"Failed to check uptrend for {market_key}: {err}", exc_info=True)
-            continue
+    ticks = None
+    if settings.COMPACTION_BUCKET_MS:
+        market_keys, price_data, ticks = await fetch_compacted(filters, start_time, now_ms)
+    elif settings.MRANGE_BUCKET_MS:
+        market_keys = await fetch_candidates([*filters, "type=trades"], start_time, now_ms, now)
+        price_data, _ = await fetch_ranges(market_keys, start_time, now_ms)
+    else:
+        replies = await time_series.mrange(start_time, now_ms, [*filters, "type=trades"])
+        market_keys, price_data = parse_mrange(replies)
+    await process_price_changes(evaluate_markets(market_keys, price_data, now, ticks), now)
 
-        signal_key = f"{market_key}_{period}_last_percent"
 
-        if signal_percent := await redis.get(signal_key):
-            signal_percent = round(float(signal_percent), 1)
-            if signal_ttl := await redis.ttl(signal_key):
-                signal_ttl = int(signal_ttl)
-        else:
-            signal_ttl = int(period if period < (60 * 5) else period / 2)
+async def fetch_ranges(
+    market_keys: list[str], start_time: int, now_ms: int
+) -> tuple[list[list], list[list[int]] | None]:
+    bucket_ms = settings.COMPACTION_BUCKET_MS
+    suffixes = [f"_{aggregation}" for aggregation in COMPACTIONS] if bucket_ms else []
+    async with redis.pipeline(transaction=False) as pipe:
+        for market_key in market_keys:
+            for suffix in suffixes:
+                pipe.ts().range(f"{market_key}{suffix}", start_time, now_ms)
+            pipe.ts().range(market_key, start_time, now_ms)
+        results = await pipe.execute(raise_on_error=False)
 
-        if signals := await time_series.range(f"{market_key}_signals", before_24h, now_ms):
-            signals = len(signals)
-        else:
-            signals = 0
+    # missing series come back as errors and are skipped like empty ranges
+    results = [result if isinstance(result, list) else [] for result in results]
+    if not bucket_ms:
+        return results, None
+    step = len(suffixes) + 1
+    merged = [
+        merge_compacted(results[i : i + step - 2], results[i + step - 2], results[i + step - 1], bucket_ms)
+        for i in range(0, len(results), step)
+    ]
+    return [points for points, _ in merged], [ticks for _, ticks in merged]
 
-        if abs(price_change_percent) > threshold:
-            signal_args = (market_key, price_change_percent, period, is_uptrend, min_price, max_price, signals)
 
-            if not signal_percent:
-                await signal_action.kiq(*signal_args)
-                await redis.set(signal_key, price_change_percent, ex=signal_ttl)
-                await time_series.add(f"{market_key}_signals", now_ms, 1)
+async def fetch_compacted(
+    filters: list[str], start_time: int, now_ms: int
+) -> tuple[list[str], list[list], list[list[int]]]:
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.ts().mrange(start_time, now_ms, [*filters, "type=compacted"])
+        pipe.ts().mrange(start_time, now_ms, [*filters, "type=trades"])
+        compacted_replies, raw_replies = await pipe.execute()
 
-            elif signal_percent and abs(price_change_percent) > signal_percent:
-                try:
-                    await redis.set(signal_key, price_change_percent, ex=signal_ttl)
-                    await signal_action.kiq(*signal_args, update=True)
-                except Exception as err:
-                    await logger.aerror(f"Failed to update signal key: {err}", exc_info=True)
+    compacted: dict[str, dict[str, list]] = {}
+    for reply in compacted_replies:
+        for key, (_, points) in reply.items():
+            market_key, aggregation = key.rsplit("_", 1)
+            compacted.setdefault(market_key, {})[aggregation] = points
+    tails = dict(zip(*parse_mrange(raw_replies), strict=True))
+
+    # markets younger than a bucket only have the raw tail yet
+    market_keys = list(dict.fromkeys(chain(compacted, tails)))
+    bucket_ms = settings.COMPACTION_BUCKET_MS
+    merged = [
+        merge_compacted(
+            [compacted.get(market_key, {}).get(aggregation, []) for aggregation in PRICE_COMPACTIONS],
+            compacted.get(market_key, {}).get("count", []),
+            tails.get(market_key, []),
+            bucket_ms,
+        )
+        for market_key in market_keys
+    ]
+    return market_keys, [points for points, _ in merged], [ticks for _, ticks in merged]
+
+
+def merge_compacted(series: list[list], counts: list, tail: list, bucket_ms: int) -> tuple[list, list[int]]:
+    """Points of the closed buckets followed by the raw ticks of the open one, with running raw tick counts.
+
+    Every closed bucket stands in for its ticks with its first, min, max and last price, so the window extremes
+    are exact. `ticks[j]` is the number of raw ticks before point `j`, a bucket's count is carried by its first
+    point, so windows are gated on the ticks they cover while min, max and the trend only see the points.
+    """
+    # sorting is stable and keeps the aggregation order inside a bucket
+    points = sorted(chain.from_iterable(series), key=itemgetter(0))
+    bucket_ticks = dict(counts)
+    merged: list = []
+    ticks = [0]
+    for timestamp, bucket in groupby(points, key=itemgetter(0)):
+        # a bucket with a single tick has four equal aggregates, one of them is enough
+        prices = list(dict.fromkeys(price for _, price in bucket))
+        merged.extend([timestamp, price] for price in prices)
+        # series provisioned before the count rule have no count, their buckets count their points
+        ticks.append(ticks[-1] + int(bucket_ticks.get(timestamp, len(prices))))
+        ticks.extend([ticks[-1]] * (len(prices) - 1))
+    # the open bucket isn't compacted until a later tick arrives, its ticks are still in the raw series
+    closed = merged[-1][0] + bucket_ms if merged else 0
+    for point in tail:
+        if point[0] >= closed:
+            merged.append(point)
+            ticks.append(ticks[-1] + 1)
+    return merged, ticks
+
+
+async def fetch_candidates(filters: list[str], start_time: int, now_ms: int, now: float) -> list[str]:
+    bucket_ms = settings.MRANGE_BUCKET_MS
+    # both aggregations have to see the same samples, otherwise their buckets don't line up
+    async with redis.pipeline(transaction=True) as pipe:
+        for aggregation in ("min", "max"):
+            pipe.ts().mrange(start_time, now_ms, filters, aggregation_type=aggregation, bucket_size_msec=bucket_ms)
+        low_replies, high_replies = await pipe.execute()
+
+    lows, highs = PriceWindows(*parse_mrange(low_replies)), PriceWindows(*parse_mrange(high_replies))
+    return bucket_candidates(lows, highs, now, bucket_ms)
+
+
+def parse_mrange(replies: list[dict]) -> tuple[list[str], list[list]]:
+    market_keys, price_data = [], []
+    for reply in replies:
+        for market_key, (_, points) in reply.items():
+            market_keys.append(market_key)
+            price_data.append(points)
+    return market_keys, price_data
+
+
+async def process_price_changes(changes: dict[str, list[PriceChange]], now: float, check_timeout: float = 0) -> None:
+    if not changes:
+        return
+
+    try:
+        decisions = await decide_signals(changes, now, check_timeout)
+    except Exception as err:
+        await logger.aerror(f"Failed to decide signals for {len(changes)} markets: {err}", exc_info=True)
+        return
+
+    for market_key, change, decision, signals in decisions:
+        if decision == "nothing":
+            continue
+
+        signal_args = (
+            market_key,
+            change.percent,
+            change.period,
+            change.is_uptrend,
+            change.min_price,
+            change.max_price,
+            signals,
+        )
+        # no partition label: Telegram rate limits and 429 waits must not hold up the checks of the partition
+        await signal_action.kiq(*signal_args, update=decision == "update")
+
+
+@broker.task
+async def handle_price_changes(market_key: str, changes: list[list]) -> None:
+    await process_price_changes({market_key: [PriceChange(*change) for change in changes]}, time.time())
 
 
 @broker.task
@@ -119,29 +229,50 @@ async def signal_action(
     try:
         period_min = int(period / 60)
         signal_ttl = int(period if period_min < 5 else period / 2)
+        exchange, symbol = market_key.split("_", 1)
+
+        # the text is the same for every chat, so it's rendered once per signal
+        message = create_tg_message(exchange, symbol, is_uptrend, period_min, percent, min_price, max_price, signals)
+        await asyncio.gather(
+            *(
+                deliver_signal(chat_id, market_key, percent, period, is_uptrend, message, signal_ttl, update)
+                for chat_id in settings.TARGET_IDS
+            )
+        )
+    except Exception as err:
+        await logger.aerror(f"Failed to send signal action: {err}", exc_info=True)
+
+
+async def deliver_signal(
+    chat_id: int,
+    market_key: str,
+    percent: float,
+    period: int,
+    is_uptrend: bool,
+    message: str,
+    signal_ttl: int,
+    update: bool,
+) -> None:
+    try:
+        period_min = int(period / 60)
         action = "выросла" if is_uptrend else "упала"
         txt_action = "up" if is_uptrend else "down"
-
         exchange, symbol = market_key.split("_", 1)
+        msg_key = f"{chat_id}_{exchange}_{symbol}_{period}_{txt_action}"
 
-        msg_args = (exchange, symbol, is_uptrend, period_min, percent, min_price, max_price, signals)
-        for chat_id in settings.TARGET_IDS:
-            msg_key = f"{chat_id}_{exchange}_{symbol}_{period}_{txt_action}"
-
-            if not update:
-                await logger.ainfo(
-                    f"[{chat_id}] Цена {exchange}:{symbol} {action} на {abs(percent)}% " f"за период {period_min} мин"
-                )
-                if tg_msg_id := await send_tg_message(chat_id, create_tg_message(*msg_args)):
-                    await redis.set(msg_key, tg_msg_id, ex=signal_ttl)
-                    logger.debug(f"TG message delivered: {tg_msg_id}")
-            else:
-                await logger.ainfo(
-                    f"[{chat_id}] UPD: цена {exchange}:{symbol} {action} на {abs(percent)}% "
-                    f"за период {period_min} мин"
-                )
-                if tg_msg_id := await redis.get(msg_key):
-                    await update_tg_message(chat_id, int(tg_msg_id), create_tg_message(*msg_args))
-                    logger.debug(f"TG message updated successfully: {tg_msg_id}")
+        if not update:
+            await logger.ainfo(
+                f"[{chat_id}] Цена {exchange}:{symbol} {action} на {abs(percent)}% " f"за период {period_min} мин"
+            )
+            if tg_msg_id := await send_tg_message(chat_id, message):
+                await redis.set(msg_key, tg_msg_id, ex=signal_ttl)
+                logger.debug(f"TG message delivered: {tg_msg_id}")
+        else:
+            await logger.ainfo(
+                f"[{chat_id}] UPD: цена {exchange}:{symbol} {action} на {abs(percent)}% " f"за период {period_min} мин"
+            )
+            if tg_msg_id := await redis.get(msg_key):
+                await update_tg_message(chat_id, int(tg_msg_id), message)
+                logger.debug(f"TG message updated successfully: {tg_msg_id}")
     except Exception as err:
-        await logger.aerror(f"Failed to send signal action: {err}", exc_info=True)
+        await logger.aerror(f"Failed to deliver signal to {chat_id}: {err}", exc_info=True)